@@ -8,6 +8,7 @@ from elevenlabs import voices
 import irsdk
 from PIL import Image
 
+from core import async_director
 from core import common
 from core import director
 from core import editor
@@ -73,8 +74,14 @@ class App(ctk.CTk):
         # Select home frame
         self.show_frame(frame="home")
 
-        # Create the director
-        self.director = director.Director()
+        # Create the director, using the asyncio runtime if selected
+        runtime = common.settings.get(
+            "general", "director_runtime", fallback="threaded"
+        )
+        if runtime == "asyncio":
+            self.director = async_director.AsyncDirector()
+        else:
+            self.director = director.Director()
 
         # Create the editor
         self.editor = editor.Editor()
@@ -992,15 +999,26 @@ class App(ctk.CTk):
             # Change button text
             self.btn_start_stop.configure(text="⏵ Start Commentary")
 
-            # Stop the director
-            self.director.stop()
+            # Stop the director and create the video in a separate thread,
+            # so the window stays responsive while the director's queues drain
+            self.btn_start_stop.configure(state="disabled")
+            threading.Thread(target=self.stop_director).start()
 
-            # Add messages
-            self.add_message("Commentary stopped!")
-            self.add_message("Generating video...")
+    def stop_director(self):
+        """Stop the director, then create the video.
 
-            # Create the video
-            threading.Thread(target=self.editor.create_video).start()
+        Runs on a background thread. The start/stop button is disabled until
+        the director has stopped, so it cannot be started again mid-drain.
+        """
+        self.director.stop()
+        self.btn_start_stop.configure(state="normal")
 
-            # Add message
-            self.add_message("Video generated!")
\ No newline at end of file
+        # Add messages
+        self.add_message("Commentary stopped!")
+        self.add_message("Generating video...")
+
+        # Create the video
+        self.editor.create_video()
+
+        # Add message
+        self.add_message("Video generated!")
\ No newline at end of file
@@ -0,0 +1,306 @@
+"""
+Module: async_director.py
+
+This module provides an asyncio runtime for the director. Telemetry polling,
+database flushes and every commentary and text-to-speech request run as
+cooperating tasks on a single event loop, so any number of requests can be in
+flight without a thread per request.
+
+Each commentary request has a deadline, and requests for events the race has
+already moved past are cancelled, so stale commentary is never spoken.
+"""
+
+import asyncio
+import threading
+import time
+
+import httpx
+
+from core import common, director, telemetry
+from core import tts_integration
+
+
+class AsyncDirector(director.Director):
+    """A director that runs on an asyncio event loop instead of threads.
+
+    It shares its components (telemetry source, event detector, commentary
+    generator, camera manager, scheduler) with the threaded Director, and
+    can be used in its place: start() runs the event loop on a background
+    thread, run() runs it on the calling thread, and stop() ends it.
+    """
+
+    def __init__(self, source=None):
+        super().__init__(source)
+
+        # Limits for in-flight commentary requests
+        get = self.config_manager.get
+        self.max_in_flight = int(get("general", "max_in_flight_commentary", fallback="4"))
+        self.commentary_timeout = float(get("general", "commentary_timeout", fallback="10"))
+        self.stale_after = float(get("general", "commentary_stale_after", fallback="15"))
+        self.db_flush_interval = float(get("general", "db_flush_interval", fallback="0.5"))
+
+        # Text-to-speech is only used once an API key is configured
+        self.tts = tts_integration.TTSIntegration()
+
+        self.loop = None
+        self.in_flight = {}
+        self.completed = 0
+        self.timed_out = 0
+        self.cancelled_stale = 0
+        self.failed = 0
+        self._thread = None
+        self._stop_event = None
+        self._persist_queue = None
+        self._commentary_records = []
+        self._semaphore = None
+        self._http = None
+
+    def start(self):
+        """Run the event loop on a background thread."""
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(
+            target=asyncio.run, args=(self.run_async(),),
+            name="director-asyncio", daemon=True
+        )
+        self._thread.start()
+
+    def run(self):
+        """Run the event loop on the calling thread until stopped."""
+        self.running = True
+        asyncio.run(self.run_async())
+
+    def stop(self):
+        """Stop the event loop, flushing queued records to the database."""
+        self.running = False
+        if self.loop is not None and self._stop_event is not None:
+            self.loop.call_soon_threadsafe(self._stop_event.set)
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=10.0)
+
+    async def run_async(self):
+        """Run the director's tasks until stopped or the source runs out."""
+        self.loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._persist_queue = asyncio.Queue()
+        self._commentary_records = []
+        self.frame_pool = telemetry.SnapshotPool(64, self.telemetry.num_cars)
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._reset_session()
+
+        # The database manager lives until every task has finished
+        self._open_database()
+        self._open_recorder()
+
+        try:
+            async with httpx.AsyncClient(timeout=self.commentary_timeout) as client:
+                self._http = client
+                poll = asyncio.create_task(self._poll())
+                flush = asyncio.create_task(self._flush_db())
+                await self._stop_event.wait()
+                self.running = False
+
+                # Stop polling, abandon pending commentary, then flush
+                tasks = [poll, flush, *self.in_flight]
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                self.coalescer.clear()
+                self._flush_pending()
+        finally:
+            self._http = None
+            self._close_database()
+            if self.recorder:
+                self.recorder.close(self.telemetry.names)
+                self.recorder = None
+            self.loop = None
+
+    async def _read(self):
+        """Read the next telemetry frame without blocking the event loop.
+
+        Returns:
+            FieldSnapshot: The updated field snapshot, or None.
+        """
+        # Read straight into the event detector's current slot
+        target = common.snapshots.current
+
+        # Replay sources sleep until their next frame is due
+        if self.telemetry.paced:
+            return await asyncio.to_thread(self.fetch_telemetry_data, target)
+        return self.fetch_telemetry_data(target)
+
+    async def _poll(self):
+        """Telemetry task: sample the source until stopped or it runs out."""
+        try:
+            await self._poll_loop()
+        finally:
+            self._stop_event.set()
+
+    async def _poll_loop(self):
+        """Sample the telemetry source and react to each tick."""
+        self.scheduler.start()
+        while self.running:
+            snapshot = await self._read()
+            if snapshot is None:
+                if self.telemetry.finished:
+                    return
+                await self.scheduler.wait_async()
+                continue
+
+            # Record the frame for offline replay
+            if self.recorder:
+                self.recorder.write(snapshot)
+
+            # Keep a copy of the raw frame for the next database flush, which
+            # returns it to the pool
+            frame = self.frame_pool.acquire()
+            frame.copy_from(snapshot)
+
+            # Smooth the telemetry the event detector sees, after copying the raw frame
+            if self.telemetry_filter:
+                self.telemetry_filter.apply(snapshot)
+
+            # Detect events
+            common.driver_names = self.telemetry.names
+            detected_events = self.event_detector.get_events()
+
+            # Queue the raw frame and its events for the next database flush
+            current_timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+            self._persist_queue.put_nowait((current_timestamp, frame, detected_events))
+
+            # Start commentary on each batch of events the coalescer has
+            # collected and admission lets through, and drop any the race has
+            # moved on from
+            for batch in self.coalescer.add(detected_events, snapshot.session_time):
+                batch = self.admit(batch)
+                if batch:
+                    self._start_commentary(batch, snapshot.session_time)
+            self._cancel_stale(snapshot.session_time)
+
+            # Switch the camera (this is a quick broadcast message)
+            focus = self.camera_focus(snapshot)
+            if focus is not None:
+                self.camera_manager.choose_random_camera(car_idx=focus)
+
+            # The next tick is read over the previous one
+            self.event_detector.update_previous_drivers()
+
+            if self.telemetry.paced:
+                await asyncio.sleep(0)
+            else:
+                await self.scheduler.wait_async()
+
+    def _start_commentary(self, detected_events, session_time):
+        """Start a commentary task for a batch of events.
+
+        Args:
+            detected_events (list): The events to commentate on.
+            session_time (float): The session time the events happened at.
+        """
+        task = asyncio.create_task(self._commentate(detected_events, time.time()))
+        self.in_flight[task] = session_time
+        task.add_done_callback(self._commentary_done)
+
+    def _cancel_stale(self, session_time):
+        """Cancel commentary for events too far behind the race.
+
+        Args:
+            session_time (float): The current session time.
+        """
+        for task, started in list(self.in_flight.items()):
+            if session_time - started > self.stale_after:
+                task.cancel()
+
+    def _commentary_done(self, task):
+        """Count the outcome of a finished commentary task."""
+        self.in_flight.pop(task, None)
+        if task.cancelled():
+            if self.running:
+                self.cancelled_stale += 1
+        elif isinstance(task.exception(), asyncio.TimeoutError):
+            self.timed_out += 1
+        elif task.exception() is not None:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    async def _commentate(self, detected_events, timestamp):
+        """Commentary task: generate commentary text and speak it.
+
+        Waits for one of the max_in_flight slots, then applies the commentary
+        timeout to each request. The commentary is stored by the next database
+        flush, so the task never waits on the database.
+
+        Args:
+            detected_events (list): The events to commentate on.
+            timestamp (float): Wall clock time the events were detected at.
+        """
+        settled = False
+        try:
+            async with self._semaphore:
+                context = common.context or {}
+                commentary_text = ""
+                try:
+                    commentary_text = await asyncio.wait_for(
+                        self.commentary_generator.agenerate(detected_events, {"league": context.get("league", {})}),
+                        self.commentary_timeout
+                    )
+                finally:
+                    settled = True
+                    self.admission.settle(len(commentary_text or ""))
+                if commentary_text:
+                    self._commentary_records.append((
+                        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)),
+                        commentary_text, detected_events
+                    ))
+                if commentary_text and self.tts.api_key:
+                    await asyncio.wait_for(
+                        self.tts.speak(self._http, commentary_text, timestamp=timestamp),
+                        self.commentary_timeout
+                    )
+        finally:
+            # A task cancelled while still waiting for a slot never made its request
+            if not settled:
+                self.admission.settle(0)
+
+    async def _flush_db(self):
+        """Database task: write queued records every db_flush_interval."""
+        while True:
+            await asyncio.sleep(self.db_flush_interval)
+            self._flush_pending()
+
+    def _flush_pending(self):
+        """Write every queued frame, event and commentary to the database."""
+        while not self._persist_queue.empty():
+            current_timestamp, frame, detected_events = self._persist_queue.get_nowait()
+            self.db_manager.insert_frame(frame, self.telemetry.names)
+            self.frame_pool.release(frame)
+            for event in detected_events:
+                self.db_manager.insert_event(
+                    event_type=event.get("type", "unknown"),
+                    description=event.get("description", ""),
+                    driver=event.get("driver", ""),
+                    timestamp=event.get("timestamp", current_timestamp),
+                    session_time=event.get("session_time")
+                )
+
+        records, self._commentary_records = self._commentary_records, []
+        for current_timestamp, commentary_text, detected_events in records:
+            self.db_manager.insert_commentary(commentary_text, detected_events, current_timestamp)
+
+    def pipeline_stats(self):
+        """Get the in-flight commentary and database queue metrics.
+
+        Returns:
+            dict: Counts of in-flight, completed, timed out, stale-cancelled
+                and failed commentary tasks, and the database queue depth.
+        """
+        return {
+            "in_flight": len(self.in_flight),
+            "completed": self.completed,
+            "timed_out": self.timed_out,
+            "cancelled_stale": self.cancelled_stale,
+            "failed": self.failed,
+            "persist_queue": self._persist_queue.qsize() if self._persist_queue else 0
+        }
@@ -0,0 +1,179 @@
+"""
+Module: coalescer.py
+
+Event coalescing for IntelliCaster.
+Race starts and multi-car incidents produce dozens of events within a second. Rather than sending
+every tick's events to the commentary generator, the EventCoalescer collects events over a short
+window of session time and hands them on as one batch, merging related events (an overtake chain,
+a pile-up) into a single summary event. Every original event is kept inside its summary, so nothing
+is lost, but a burst costs one commentary and text-to-speech request instead of dozens.
+"""
+
+# Event types that make up an incident
+INCIDENT_TYPES = ("off_track", "stopped")
+
+# Largest lap distance percent between incident events that are part of one pile-up
+INCIDENT_SPREAD = 0.02
+
+# Largest lap distance percent between overtakes that are part of one chain
+OVERTAKE_SPREAD = 0.05
+
+def _join_names(names):
+    """
+    Join driver names into a readable list (e.g., 'A, B and C').
+    """
+    if len(names) <= 1:
+        return "".join(names)
+    return f"{', '.join(names[:-1])} and {names[-1]}"
+
+class EventCoalescer:
+    def __init__(self, window=1.0, max_batch=8):
+        """
+        :param window: Seconds of session time events are collected for before being sent on.
+            With a window of 0, each tick's events are sent on as they are detected.
+        :param max_batch: Most events in one batch; a full batch is sent on straight away.
+        """
+        self.window = window
+        self.max_batch = max(int(max_batch), 1)
+        self._pending = []
+        self._opened_at = None
+        self.events_in = 0
+        self.batches_out = 0
+
+    def add(self, events, session_time):
+        """
+        Add a tick's events and collect any batches that are ready.
+        Call this every tick, even without events, so an open window is closed on time.
+        :param events: List of event dictionaries detected this tick.
+        :param session_time: Session time of the tick.
+        :return: List of batches, each a list of event dictionaries, ready for commentary.
+        """
+        # Session time going backwards means a new session: start over
+        if self._opened_at is not None and session_time < self._opened_at:
+            self._opened_at = session_time
+
+        batches = []
+        for event in events:
+            if not self._pending:
+                self._opened_at = session_time
+            self._pending.append(event)
+            self.events_in += 1
+            if len(self._pending) >= self.max_batch:
+                batches.append(self.flush())
+
+        if self._pending and session_time - self._opened_at >= self.window:
+            batches.append(self.flush())
+        return batches
+
+    def flush(self):
+        """
+        Send on the pending events now, merging related ones.
+        :return: The merged batch, or an empty list if nothing was pending.
+        """
+        if not self._pending:
+            return []
+        batch = merge_related(self._pending)
+        self._pending = []
+        self._opened_at = None
+        self.batches_out += 1
+        return batch
+
+    def clear(self):
+        """
+        Drop the pending events without sending them on, e.g., when the director stops.
+        :return: The number of events dropped.
+        """
+        dropped = len(self._pending)
+        self._pending = []
+        self._opened_at = None
+        return dropped
+
+    def stats(self):
+        """
+        Get the number of events collected, batches sent on and events still pending.
+        """
+        return {
+            "events_in": self.events_in,
+            "batches_out": self.batches_out,
+            "pending": len(self._pending)
+        }
+
+def merge_related(events):
+    """
+    Merge related events in a batch into summary events.
+    Overtakes close together on track become one overtake chain, and incident events close
+    together on track become one pile-up. The original events of a summary are kept in its
+    'events' list.
+    :param events: List of event dictionaries.
+    :return: List of event dictionaries, in the order the first event of each group was detected.
+    """
+    overtakes = [e for e in events if e.get("type") == "overtake"]
+    incidents = [e for e in events if e.get("type") in INCIDENT_TYPES]
+    groups = {}
+
+    # Overtake chains: cars changing places around the same point on track, in the order the
+    # overtakes were detected
+    for cluster in _clusters(overtakes, OVERTAKE_SPREAD):
+        cluster.sort(key=events.index)
+        groups[id(cluster[0])] = _summarize(
+            "overtake_chain", cluster,
+            "Positions are changing hands as {names} make their moves."
+        )
+
+    # Pile-ups: incidents clustered around the same point on track
+    for cluster in _clusters(incidents, INCIDENT_SPREAD):
+        first = min(cluster, key=events.index)
+        groups[id(first)] = _summarize(
+            "incident", cluster,
+            "Multi-car incident at lap progress {lap_percent:.2f} involving {names}."
+        )
+
+    merged_ids = {id(e) for group in groups.values() for e in group["events"]}
+    batch = []
+    for event in events:
+        if id(event) in groups:
+            batch.append(groups[id(event)])
+        elif id(event) not in merged_ids:
+            batch.append(event)
+    return batch
+
+def _clusters(events, spread):
+    """
+    Group events by their point on track.
+    :param events: List of event dictionaries.
+    :param spread: Largest lap distance percent between neighbouring events of a group.
+    :return: List of the groups of more than one event, each a list sorted by lap distance percent.
+    """
+    clusters = []
+    cluster = []
+    for event in sorted(events, key=lambda e: e.get("lap_percent") or 0.0) + [None]:
+        if cluster and (event is None or
+                        (event.get("lap_percent") or 0.0) - (cluster[-1].get("lap_percent") or 0.0) > spread):
+            if len(cluster) > 1:
+                clusters.append(cluster)
+            cluster = []
+        if event is not None:
+            cluster.append(event)
+    return clusters
+
+def _summarize(event_type, members, template):
+    """
+    Create a summary event for a group of related events.
+    """
+    first = members[0]
+    drivers = list(dict.fromkeys(e.get("driver", "") for e in members))
+    return {
+        "id": first.get("id"),
+        "type": event_type,
+        "description": template.format(
+            names=_join_names(drivers), lap_percent=first.get("lap_percent") or 0.0
+        ),
+        "driver": drivers[0] if drivers else "",
+        "drivers": drivers,
+        "car_idx": first.get("car_idx"),
+        "lap": first.get("lap"),
+        "lap_percent": first.get("lap_percent"),
+        "session_time": first.get("session_time"),
+        "timestamp": first.get("timestamp"),
+        "events": members
+    }
@@ -16,6 +16,7 @@ class CommentaryGenerator:
         # Retrieve model parameters from settings; fallback to default models
         self.model = common.settings.get("commentary", "model", fallback="gpt-4-turbo-preview")
         self.temperature = float(common.settings.get("commentary", "temperature", fallback="0.7"))
+        self._async_client = None
     
     def generate(self, events, context):
         """
@@ -46,6 +47,40 @@ class CommentaryGenerator:
             common.app.add_message(f"Error generating commentary: {str(e)}")
             return ""
 
+    async def agenerate(self, events, context):
+        """
+        Generate commentary text on an asyncio event loop.
+
+        Behaves like generate(), but awaits the OpenAI request instead of
+        blocking, so many requests can be in flight at once. Cancelling the
+        awaiting task cancels the request.
+
+        :param events: List of event dictionaries (e.g., overtakes, stops) with timestamps.
+        :param context: Dictionary containing race context (e.g., league details).
+        :return: Generated commentary text.
+        """
+        try:
+            prompt = prompt_templates.get_prompt(events, context)
+            messages = [
+                {"role": "system", "content": "You are an energetic and insightful sim racing commentator."},
+                {"role": "user", "content": prompt}
+            ]
+            if self._async_client is None:
+                api_key = common.settings.get("keys", "openai_api_key", fallback="")
+                self._async_client = openai.AsyncOpenAI(api_key=api_key or None)
+            response = await self._async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=300
+            )
+            commentary_text = response.choices[0].message.content.strip()
+            common.app.add_message(f"AI Commentary: {commentary_text}")
+            return commentary_text
+        except Exception as e:
+            common.app.add_message(f"Error generating commentary: {str(e)}")
+            return ""
+
 if __name__ == "__main__":
     # For testing: simulate some events and context
     test_events = [
@@ -66,9 +66,11 @@ context = None
 # The IRSDK object
 ir = None
 
-# Dictionaries to track the status of the drivers
-drivers = []
-prev_drivers = []
+# Double buffer (telemetry.SnapshotBuffer) of the current and previous tick
+snapshots = None
+
+# Driver names indexed by car idx
+driver_names = []
 
 # Race status variables
 race_started = False
@@ -26,8 +26,63 @@ class ConfigManager:
             self.config["general"] = {
                 "telemetry_threshold": "0.5",
                 "director_update_freq": "0.1",
+                "tick_overrun_policy": "skip",
+                "pipeline_queue_size": "64",
+                "director_runtime": "threaded",
+                "max_in_flight_commentary": "4",
+                "commentary_timeout": "10",
+                "commentary_stale_after": "15",
+                "commentary_coalesce_window": "1.0",
+                "commentary_max_batch": "8",
+                "commentary_max_per_minute": "6",
+                "commentary_char_budget": "3000",
+                "commentary_min_priority": "0.3",
+                "commentary_chars_per_request": "400",
+                "db_flush_interval": "0.5",
+                "db_write_behind": "1",
+                "db_batch_size": "500",
+                "db_synchronous": "NORMAL",
+                "db_telemetry_storage": "rows",
+                "db_keyframe_interval": "100",
+                "db_keep_sessions": "20",
+                "db_max_size_gb": "0",
+                "db_prune_interval": "300",
+                "db_read_connections": "4",
+                "db_max_queued": "10000",
                 "event_hist_len": "30",
-                "events_update_freq": "0.5"
+                "event_dedup_window": "10",
+                "events_update_freq": "0.5",
+                "zero_copy_telemetry": "0",
+                "telemetry_record_path": "",
+                "telemetry_replay_path": "",
+                "telemetry_replay_speed": "1"
+            }
+            self.config["filters"] = {
+                "kind": "none",
+                "window": "5",
+                "alpha": "0.5",
+                "min_cutoff": "1.0",
+                "beta": "0.0",
+                "d_cutoff": "1.0",
+                "process_noise": "1e-6",
+                "measurement_noise": "1e-6",
+                "wrap": "1.0"
+            }
+            self.config["detectors"] = {
+                "overtake": "1",
+                "car_state": "1",
+                "car_state_stop_speed": "0.001",
+                "car_state_resume_speed": "0.003",
+                "car_state_pit_dwell": "1",
+                "car_state_off_track_dwell": "0.5",
+                "car_state_stopped_dwell": "3",
+                "car_state_running_dwell": "2",
+                "battle": "1",
+                "battle_gap": "1.0",
+                "battle_release_gap": "1.5",
+                "battle_closing_window": "5",
+                "battle_closing_gap": "0.5",
+                "battle_closing_range": "3"
             }
             self.save_config()
     
@@ -1,96 +1,492 @@
 import time
 import threading
-from core import common, events, commentary, camera
-from core import telemetry_filters, config_manager, database_manager
+import sqlite3
+from core import common, events, coalescer, priority, commentary, camera
+from core import telemetry, telemetry_filters, memory_reader, recorder, scheduler, pipeline
+from core import config_manager, database_manager
 
 class Director:
-    def __init__(self):
+    def __init__(self, source=None):
         # Initialize running flag
         self.running = False
 
         # Initialize configuration manager
         self.config_manager = config_manager.ConfigManager()
         
-        # Initialize database manager
-        self.db_manager = database_manager.DatabaseManager()
+        # The database manager is opened when the director starts and closed
+        # once every pipeline stage has stopped
+        self.db_manager = None
+        self._db_lock = threading.Lock()
         
-        # Initialize event detection (existing logic from events.py)
-        self.event_detector = events.Events()
+        # Initialize event detection, keeping the last event_hist_len events and
+        # running the detectors enabled in the [detectors] section
+        self.event_detector = events.Events(
+            hist_len=int(self.config_manager.get("general", "event_hist_len", fallback="30")),
+            dedup_window=float(self.config_manager.get("general", "event_dedup_window", fallback="10")),
+            detector_settings=self._section("detectors")
+        )
         
+        # Batch bursts of events into one commentary request per coalescing window
+        self.coalescer = coalescer.EventCoalescer(
+            window=float(self.config_manager.get("general", "commentary_coalesce_window", fallback="1.0")),
+            max_batch=int(self.config_manager.get("general", "commentary_max_batch", fallback="8"))
+        )
+
+        # Cap the commentary rate and characters per minute, dropping low
+        # priority events under load
+        get = self.config_manager.get
+        self.admission = priority.AdmissionController(
+            max_per_minute=float(get("general", "commentary_max_per_minute", fallback="6")),
+            char_budget=float(get("general", "commentary_char_budget", fallback="3000")),
+            min_priority=float(get("general", "commentary_min_priority", fallback="0.3")),
+            chars_per_request=int(get("general", "commentary_chars_per_request", fallback="400"))
+        )
+
         # Initialize commentary generator (AI functionality)
         self.commentary_generator = commentary.CommentaryGenerator()
         
         # Initialize camera manager for dynamic view switching
         self.camera_manager = camera.Camera()
+
+        # Initialize the telemetry source and its preallocated field snapshot
+        self.telemetry = source if source is not None else self._create_source()
+        self.snapshot = self.telemetry.new_snapshot()
+
+        # Double buffer of the current and previous tick for the event detector
+        common.snapshots = telemetry.SnapshotBuffer(self.telemetry.num_cars)
+
+        # Optional smoothing of the telemetry the event detector sees
+        self.telemetry_filter = telemetry_filters.create_snapshot_filter(
+            self.telemetry.num_cars, self._section("filters")
+        )
+
+        # Path to record every telemetry frame to; empty disables recording
+        self.record_path = self.config_manager.get("general", "telemetry_record_path", fallback="")
+        self.recorder = None
         
         # Set update frequency from configuration; default fallback is 0.1 seconds
         self.update_freq = float(self.config_manager.get("general", "director_update_freq", fallback="0.1"))
 
-    def run(self):
-        """Main loop that orchestrates telemetry data processing, event detection,
-        commentary generation, and camera management."""
+        # Hold the loop to update_freq regardless of how long each tick takes
+        self.scheduler = scheduler.TickScheduler(
+            self.update_freq,
+            policy=self.config_manager.get("general", "tick_overrun_policy", fallback=scheduler.SKIP)
+        )
+
+        # The staged pipeline and its pool of frames are built when the
+        # director is started
+        self.pipeline = None
+        self.frame_pool = None
+
+    def _section(self, section):
+        """Read a whole section of the configuration.
+
+        The [detectors] section maps detector names to whether they are
+        enabled, and '<name>_<option>' keys to detector options. The [filters]
+        section selects the telemetry filter ('kind') and its options.
+
+        Args:
+            section (str): The section name.
+
+        Returns:
+            dict: The section's keys and values, or an empty dict.
+        """
+        config = self.config_manager.get_config()
+        if not config.has_section(section):
+            return {}
+        return dict(config[section])
+
+    def _create_source(self):
+        """Create the telemetry source selected in the configuration.
+
+        Returns:
+            TelemetrySource: A replay of a recording if telemetry_replay_path
+                is set, otherwise a live adapter over common.ir.
+        """
+        replay_path = self.config_manager.get("general", "telemetry_replay_path", fallback="")
+        if replay_path:
+            speed = float(self.config_manager.get("general", "telemetry_replay_speed", fallback="1"))
+            return recorder.ReplaySource(replay_path, speed)
+
+        # Optionally read the shared memory directly instead of via pyirsdk
+        reader = None
+        if self.config_manager.get("general", "zero_copy_telemetry", fallback="0") == "1":
+            reader = memory_reader.SharedMemoryReader()
+        return telemetry.TelemetryAdapter(reader=reader)
+
+    def start(self):
+        """Start the director's pipeline stages, each on its own thread.
+
+        Telemetry ingest feeds event detection, which feeds the persist,
+        commentary and camera stages through bounded queues. Live ingest never
+        blocks: if detection falls behind, the oldest frames are dropped. A
+        replay instead waits for detection, so every recorded frame is seen.
+        Commentary and camera switching only ever act on recent events, so
+        they drop their oldest work too; the persist stage applies
+        backpressure to detection instead of losing records.
+        """
+        if self.running:
+            return
+        self._reset_session()
+        # The database outlives the stages, so the persist and commentary
+        # stages can still store what they drain on stop
+        self._open_database()
         self.running = True
-        while self.running:
-            # Fetch telemetry data (here, simulated; in practice, this comes from common.ir)
-            telemetry_data = self.fetch_telemetry_data()
-            
-            # Apply smoothing to telemetry data using our telemetry_filters module
-            smoothed_data = {}
-            for key, value in telemetry_data.items():
-                if isinstance(value, list):
-                    smoothed_data[key] = telemetry_filters.moving_average_filter(value)
-                else:
-                    smoothed_data[key] = value
-
-            # Log raw telemetry data to the database
-            current_timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-            self.db_manager.insert_telemetry(current_timestamp, telemetry_data)
-            
-            # Update global driver data (simulate integration with iRacing SDK data)
-            common.drivers = telemetry_data.get("drivers", [])
-            
-            # Detect events using our event detector (which compares current and previous driver states)
-            detected_events = self.event_detector.get_events()
-            for event in detected_events:
-                self.db_manager.insert_event(
-                    event_type=event.get("type", "unknown"),
-                    description=event.get("description", ""),
-                    driver=event.get("driver", ""),
-                    timestamp=event.get("timestamp", current_timestamp)
-                )
-            
-            # If events are detected, generate commentary text using our AI module
-            if detected_events:
-                commentary_text = self.commentary_generator.generate(detected_events, {"league": common.context.get("league", {})})
-                # (Optional) Here we could pass commentary_text to the TTS pipeline for voice synthesis
-            
-            # Update camera view based on race conditions (example: switching to a random camera for demonstration)
-            # In a real scenario, the logic would consider which driver is in the lead or where key events occur.
-            if common.drivers:
-                # For simplicity, use the first driver's index (this should be refined)
-                self.camera_manager.choose_random_camera(car_idx=common.drivers[0].get("position", 1))
-            
-            time.sleep(self.update_freq)
+        self._open_recorder()
+
+        queue_size = int(self.config_manager.get("general", "pipeline_queue_size", fallback="64"))
+        detect_size = 8
+
+        # Frames are recycled once persisted, so enough are kept to fill the
+        # queues they pass through, plus the frame each stage is working on
+        self.frame_pool = telemetry.SnapshotPool(detect_size + queue_size + 3, self.telemetry.num_cars)
+
+        # Frames and commentary batches the queues drop are returned to the
+        # pool and settled with admission respectively
+        detect_policy = pipeline.BLOCK if self.telemetry.paced else pipeline.DROP_OLDEST
+        self.detect_queue = pipeline.StageQueue(
+            "detect", detect_size, detect_policy, on_drop=self.frame_pool.release
+        )
+        self.persist_queue = pipeline.StageQueue(
+            "persist", queue_size, pipeline.BLOCK, on_drop=lambda item: self.frame_pool.release(item[1])
+        )
+        self.commentary_queue = pipeline.StageQueue(
+            "commentary", 4, pipeline.DROP_OLDEST, on_drop=lambda batch: self.admission.settle(0)
+        )
+        self.camera_queue = pipeline.StageQueue("camera", 1, pipeline.DROP_OLDEST)
+
+        self.pipeline = pipeline.Pipeline()
+        self.pipeline.add(pipeline.Stage("ingest", self._ingest, setup=self.scheduler.start))
+        self.pipeline.add(pipeline.Stage("detect", self._detect, self.detect_queue))
+        self.pipeline.add(pipeline.Stage("persist", self._persist, self.persist_queue))
+        self.pipeline.add(
+            pipeline.Stage("commentary", self._commentate, self.commentary_queue),
+            discard_on_stop=True
+        )
+        self.pipeline.add(
+            pipeline.Stage("camera", self._switch_camera, self.camera_queue),
+            discard_on_stop=True
+        )
+        self.pipeline.start()
+
+    def run(self):
+        """Run the director until it is stopped or the telemetry source runs out.
+
+        Starts the pipeline stages and blocks until telemetry ingest ends.
+        """
+        self.start()
+        self.pipeline.wait()
+        self.stop()
 
     def stop(self):
-        """Stop the director's main loop."""
+        """Stop the director's pipeline, letting queued records be persisted.
+
+        This waits up to 10 seconds in total for the stages to drain, so UIs
+        should call it off their event thread.
+        """
         self.running = False
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        # Nothing is left to commentate on events still being coalesced
+        self.coalescer.clear()
+        self._close_database()
+        if self.recorder:
+            self.recorder.close(self.telemetry.names)
+            self.recorder = None
+
+    def _reset_session(self):
+        """Forget the state kept from the previous run of the director.
+
+        A restarted director starts a new database session, so the previous
+        ticks, detector state, event history, coalescing window and filter
+        state must not carry over into it.
+        """
+        common.snapshots.reset()
+        self.event_detector.reset()
+        self.coalescer.clear()
+        if self.telemetry_filter:
+            self.telemetry_filter.reset()
+
+    def _ingest(self):
+        """Ingest stage: read one telemetry tick and pass it to detection.
+
+        Returns:
+            bool: False once the director is stopped or the source runs out.
+        """
+        if not self.running:
+            return False
+
+        # Read the latest telemetry tick into the field snapshot
+        snapshot = self.fetch_telemetry_data()
+        if snapshot is None:
+            if self.telemetry.finished:
+                self.running = False
+                return False
+        else:
+            # Record the frame for offline replay
+            if self.recorder:
+                self.recorder.write(snapshot)
+
+            # Downstream stages get their own copy of the frame, from the pool
+            # the persist stage returns frames to
+            frame = self.frame_pool.acquire()
+            frame.copy_from(snapshot)
+            self.detect_queue.put(frame)
+
+        # Replay sources pace themselves; live telemetry is sampled at update_freq
+        if snapshot is None or not self.telemetry.paced:
+            self.scheduler.wait()
+        return True
+
+    def _detect(self, frame):
+        """Detect stage: find events in a frame and fan them out.
+
+        Args:
+            frame (FieldSnapshot): The frame to process.
+        """
+        # Fill the event detector's current slot (a copy into preallocated arrays)
+        common.snapshots.current.copy_from(frame)
+        if self.telemetry_filter:
+            self.telemetry_filter.apply(common.snapshots.current)
+        common.driver_names = self.telemetry.names
+
+        # Detect events using our event detector (which compares current and previous snapshots)
+        detected_events = self.event_detector.get_events()
+
+        # Queue commentary generation for each batch of events the coalescer
+        # has collected and the admission controller lets through
+        for batch in self.coalescer.add(detected_events, frame.session_time):
+            batch = self.admit(batch)
+            if batch:
+                self.commentary_queue.put(batch)
+
+        # Update camera view based on race conditions: follow the closest battle on
+        # track, or the first car if nobody is battling
+        focus = self.camera_focus(frame)
+        if focus is not None:
+            self.camera_queue.put(focus)
+
+        # The next frame is compared against this one
+        self.event_detector.update_previous_drivers()
+
+        # Hand the frame to the persist stage last: once persisted it goes back
+        # to the pool and is overwritten by a later tick
+        current_timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.persist_queue.put((current_timestamp, frame, detected_events))
 
-    def fetch_telemetry_data(self):
-        """
-        Simulate fetching telemetry data.
-        In the actual implementation, this data would be fetched from the iRacing SDK (common.ir).
-        """
-        # Dummy telemetry data example; replace with real sensor/SDK data as available.
-        return {
-            "drivers": [
-                {"name": "Driver A", "lap_percent": 0.75, "position": 1},
-                {"name": "Driver B", "lap_percent": 0.73, "position": 2},
-                {"name": "Driver C", "lap_percent": 0.60, "position": 3}
-            ],
-            "speed": [100, 102, 98, 101, 99],
-            "lap_times": [90.5, 89.8, 90.1, 90.3, 90.0]
-        }
+    def admit(self, batch):
+        """Score a batch of events and pass it through commentary admission.
+
+        Must be called before the event detector's snapshots are swapped, so
+        events are scored against the tick they were detected on.
+
+        Args:
+            batch (list): The events to commentate on.
+
+        Returns:
+            list: The admitted events, highest priority first, or an empty
+                list if the batch was dropped.
+        """
+        for event in batch:
+            event["priority"] = self.event_detector.score(event)
+        return self.admission.admit(batch)
+
+    def camera_focus(self, frame):
+        """Pick the car the camera should follow.
+
+        Args:
+            frame (FieldSnapshot): The current frame.
+
+        Returns:
+            int: The position of the chasing car in the closest battle, or of
+                the first car if nobody is battling, or None for an empty field.
+        """
+        car_idx = self.event_detector.battle_focus()
+        if car_idx is None:
+            cars = frame.car_indices()
+            if not len(cars):
+                return None
+            car_idx = cars[0]
+        return int(frame.position[car_idx])
+
+    def _persist(self, item):
+        """Persist stage: log a frame and its events to the database.
+
+        Args:
+            item (tuple): The timestamp, frame and detected events.
+        """
+        current_timestamp, frame, detected_events = item
+        try:
+            with self._db_lock:
+                # The database is closed if the stage outlived the stop deadline
+                if self.db_manager is None:
+                    return
+                self.db_manager.insert_frame(frame, self.telemetry.names)
+                for event in detected_events:
+                    self.db_manager.insert_event(
+                        event_type=event.get("type", "unknown"),
+                        description=event.get("description", ""),
+                        driver=event.get("driver", ""),
+                        timestamp=event.get("timestamp", current_timestamp),
+                        session_time=event.get("session_time")
+                    )
+        finally:
+            # insert_frame keeps no reference to the frame, so it can be reused
+            self.frame_pool.release(frame)
+
+    def _commentate(self, detected_events):
+        """Commentary stage: generate commentary text using our AI module.
+
+        The text is stored with its events so past commentary can be
+        searched and reused.
+
+        Args:
+            detected_events (list): The events to commentate on.
+        """
+        context = common.context or {}
+        commentary_text = ""
+        try:
+            commentary_text = self.commentary_generator.generate(detected_events, {"league": context.get("league", {})})
+        finally:
+            # A failed request is refunded its whole reservation
+            self.admission.settle(len(commentary_text or ""))
+        if commentary_text:
+            with self._db_lock:
+                if self.db_manager is not None:
+                    self.db_manager.insert_commentary(
+                        commentary_text, detected_events, time.strftime("%Y-%m-%d %H:%M:%S")
+                    )
+        # (Optional) Here we could pass commentary_text to the TTS pipeline for voice synthesis
+
+    def _switch_camera(self, car_idx):
+        """Camera stage: switch the camera to a car.
+
+        Args:
+            car_idx (int): The car to focus on.
+        """
+        self.camera_manager.choose_random_camera(car_idx=car_idx)
+
+    def _create_database(self):
+        """Open the database manager configured in the settings.
+
+        Telemetry and events are written behind on the database writer
+        thread unless db_write_behind is off. Sessions beyond
+        db_keep_sessions, or past db_max_size_gb, are pruned oldest first.
+
+        Returns:
+            DatabaseManager: The database manager.
+        """
+        get = self.config_manager.get
+        return database_manager.DatabaseManager(
+            write_behind=get("general", "db_write_behind", fallback="1") == "1",
+            flush_interval=float(get("general", "db_flush_interval", fallback="0.5")),
+            batch_size=int(get("general", "db_batch_size", fallback="500")),
+            synchronous=get("general", "db_synchronous", fallback="NORMAL"),
+            telemetry_storage=get("general", "db_telemetry_storage", fallback=database_manager.ROWS),
+            keyframe_interval=int(get("general", "db_keyframe_interval", fallback="100")),
+            keep_sessions=int(get("general", "db_keep_sessions", fallback="20")),
+            max_size_gb=float(get("general", "db_max_size_gb", fallback="0")),
+            prune_interval=float(get("general", "db_prune_interval", fallback="300")),
+            read_connections=int(get("general", "db_read_connections", fallback="4")),
+            max_queued=int(get("general", "db_max_queued", fallback="10000"))
+        )
+
+    def _open_database(self):
+        """Open the database manager and begin a session.
+
+        The manager is thread-safe, so other threads such as the UI can
+        query it while the persist stage writes.
+        """
+        self.db_manager = self._create_database()
+        self.db_manager.begin_session(type(self.telemetry).__name__)
+        if self.db_manager.vacuum_pending and common.app:
+            common.app.add_message(
+                "The database will be converted to free pruned space when the director stops."
+            )
+
+    def _open_recorder(self):
+        """Start recording telemetry if telemetry_record_path is set.
+
+        Each database session is recorded to its own file, named after the
+        session, so restarting the director never overwrites a recording.
+        """
+        if self.record_path:
+            path = recorder.session_path(self.record_path, self.db_manager.session_id)
+            self.recorder = recorder.TelemetryRecorder(path, self.telemetry.num_cars)
+
+    def _close_database(self):
+        """Close the database manager, committing any records still queued.
+
+        A database from an older version is converted to incremental vacuum
+        first, now that nothing is being recorded. The lock is held while
+        closing, so a concurrent stop() returns only once the records are
+        committed.
+        """
+        with self._db_lock:
+            if not self.db_manager:
+                return
+            if self.db_manager.vacuum_pending:
+                if common.app:
+                    common.app.add_message("Converting the database, this may take a while...")
+                try:
+                    self.db_manager.enable_incremental_vacuum()
+                except (sqlite3.Error, RuntimeError) as e:
+                    if common.app:
+                        common.app.add_message(f"Error converting the database: {e}")
+            self.db_manager.close()
+            self.db_manager = None
+
+    def pipeline_stats(self):
+        """Get the queue depth and throughput metrics of every stage.
+
+        Returns:
+            dict: The statistics reported by Pipeline.stats(), or an empty
+                dict if the director has not been started.
+        """
+        if self.pipeline is None:
+            return {}
+        return self.pipeline.stats()
+
+    def admission_stats(self):
+        """Get the commentary admission counts and budgets.
+
+        Returns:
+            dict: The statistics reported by AdmissionController.stats().
+        """
+        return self.admission.stats()
+
+    def detector_stats(self):
+        """Get the wall-clock time and hit counts of every event detector.
+
+        Returns:
+            dict: The statistics reported by DetectorRegistry.stats().
+        """
+        return self.event_detector.detector_stats()
+
+    def tick_stats(self):
+        """Get the tick jitter and overrun statistics of the main loop.
+
+        Returns:
+            dict: The statistics reported by TickScheduler.stats().
+        """
+        return self.scheduler.stats()
+
+    def fetch_telemetry_data(self, snapshot=None):
+        """Read the next telemetry frame from the telemetry source.
+
+        Args:
+            snapshot (FieldSnapshot): The snapshot to read into. Defaults to
+                the director's own snapshot.
+
+        Returns:
+            FieldSnapshot: The updated field snapshot, or None if no frame is
+                available (iRacing is not connected or the replay ended).
+        """
+        if snapshot is None:
+            snapshot = self.snapshot
+        if not self.telemetry.read(snapshot):
+            return None
+        return snapshot
 
 if __name__ == "__main__":
     director = Director()
@@ -2,150 +2,315 @@
 Module: events.py
 
 Enhanced event detection for IntelliCaster.
-This module processes race telemetry data (stored in common.drivers and common.prev_drivers),
-detecting key events such as overtakes and stops using adaptive thresholds and smoothing.
-Detected events are stored with a timestamp and description.
+This module processes race telemetry (the current and previous field snapshots held in the
+common.snapshots double buffer), detecting key events such as overtakes and stops. Cars are keyed
+on their car idx, and the detectors in a DetectorRegistry (see detectors.py) compare the two
+snapshots in a single vectorized pass. Detected events are stored with a timestamp and description.
 """
 
 import time
-from copy import deepcopy
+
+import numpy as np
+
 from core import common
-from core import telemetry_filters  # Smoothing functions (e.g., moving_average_filter)
+from core import detectors
+from core import priority
+from core import telemetry
+
+# Number of buckets each lap is split into when deduplicating events
+LAP_BUCKETS = 4
+
+class EventHistory:
+    """
+    Fixed-capacity ring buffer of recent events, ordered by session time.
+
+    Appending is O(1): once full, the oldest event is overwritten. Events are deduplicated
+    on (type, car idx, lap bucket) within a session time window, and events since a given
+    session time can be found with a binary search.
+    """
+
+    def __init__(self, capacity=30, dedup_window=10.0):
+        """
+        :param capacity: Maximum number of events kept.
+        :param dedup_window: Seconds of session time in which repeats of an event are dropped.
+        """
+        self.capacity = max(int(capacity), 1)
+        self.dedup_window = dedup_window
+        self._ring = [None] * self.capacity
+        self._start = 0
+        self._count = 0
+        self._last_seen = {}
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._ring[(self._start + i) % self.capacity]
+
+    def _key(self, event):
+        """
+        The deduplication key of an event: its type, car and coarse lap position.
+        """
+        lap = event.get("lap") or 0
+        bucket = int((event.get("lap_percent") or 0.0) * LAP_BUCKETS)
+        return (event.get("type"), event.get("car_idx"), lap * LAP_BUCKETS + bucket)
+
+    def add(self, event):
+        """
+        Append an event unless it repeats one seen within the dedup window.
+        :param event: Event dictionary with a session_time.
+        :return: True if the event was added, False if it was a duplicate.
+        """
+        key = self._key(event)
+        session_time = event.get("session_time", 0.0)
+        last = self._last_seen.get(key)
+        if last is not None and 0 <= session_time - last < self.dedup_window:
+            return False
+        self._last_seen[key] = session_time
+
+        # Forget keys outside the window once the table grows well past the ring.
+        if len(self._last_seen) > 4 * self.capacity:
+            self._last_seen = {
+                k: t for k, t in self._last_seen.items()
+                if 0 <= session_time - t < self.dedup_window
+            }
+
+        end = (self._start + self._count) % self.capacity
+        self._ring[end] = event
+        if self._count < self.capacity:
+            self._count += 1
+        else:
+            self._start = (self._start + 1) % self.capacity
+        return True
+
+    def since(self, session_time):
+        """
+        Get the events at or after a session time, oldest first.
+        :param session_time: Session time to search from.
+        :return: List of event dictionaries.
+        """
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            event = self._ring[(self._start + mid) % self.capacity]
+            if event.get("session_time", 0.0) < session_time:
+                lo = mid + 1
+            else:
+                hi = mid
+        return [self._ring[(self._start + i) % self.capacity] for i in range(lo, self._count)]
+
+    def latest(self, count=None):
+        """
+        Get the most recent events, oldest first.
+        :param count: Maximum number of events; defaults to all of them.
+        """
+        count = self._count if count is None else min(count, self._count)
+        return [self._ring[(self._start + i) % self.capacity]
+                for i in range(self._count - count, self._count)]
+
+    def clear(self):
+        """
+        Remove every event.
+        """
+        self._ring = [None] * self.capacity
+        self._start = 0
+        self._count = 0
+        self._last_seen = {}
 
 class Events:
-    def __init__(self):
-        self.events = []
+    def __init__(self, hist_len=30, dedup_window=10.0, detector_settings=None):
+        """
+        :param hist_len: Number of recent events kept in the history (event_hist_len).
+        :param dedup_window: Seconds of session time in which repeated events are dropped.
+        :param detector_settings: Optional mapping of detector names to booleans and of
+            '<name>_<option>' keys to detector options (the [detectors] settings section).
+        """
+        self.history = EventHistory(hist_len, dedup_window)
+        self.registry = detectors.default_registry()
+        if detector_settings:
+            self.registry.configure(detector_settings)
         self.id_counter = 0
 
-    def _add_event(self, event_type, description, driver, lap_percent=None):
+    @property
+    def events(self):
+        """
+        The recent events kept in the history, oldest first.
+        """
+        return self.history.latest()
+
+    @property
+    def current(self):
+        """
+        The snapshot of the current tick, or None before the first tick.
+        """
+        return common.snapshots.current if common.snapshots else None
+
+    @property
+    def previous(self):
+        """
+        The snapshot of the previous tick, or None before the second tick.
+        """
+        return common.snapshots.previous if common.snapshots else None
+
+    def _name(self, car_idx):
         """
-        Create and store an event.
+        Look up the driver name for a car idx, falling back to the car idx itself.
+        """
+        names = common.driver_names
+        if car_idx < len(names) and names[car_idx]:
+            return names[car_idx]
+        return f"Car {car_idx}"
+
+    def _add_event(self, event_type, description, car_idx, lap_percent=None):
+        """
+        Create an event for a car in the current snapshot.
         """
         event = {
             "id": self.id_counter,
             "type": event_type,
             "description": description,
-            "driver": driver,
+            "driver": self._name(car_idx),
+            "car_idx": int(car_idx),
+            "lap": int(self.current.lap[car_idx]),
+            "position": int(self.current.position[car_idx]),
             "lap_percent": lap_percent,
+            "session_time": self.current.session_time,
             "timestamp": time.time()
         }
-        self.events.append(event)
         self.id_counter += 1
+        return event
 
-    def _detect_overtakes(self):
-        """
-        Compare current and previous driver positions to detect overtakes.
-        Uses adaptive logic based on changes in positions and lap percentages.
-        """
-        detected_events = []
-        if not common.prev_drivers:
-            return detected_events
-
-        for curr in common.drivers:
-            # Locate previous data for the same driver.
-            prev = next((d for d in common.prev_drivers if d.get("name") == curr.get("name")), None)
-            if not prev:
-                continue
-
-            # Check if current position is better (lower number) than before.
-            if curr.get("position", 999) < prev.get("position", 999):
-                # Calculate the difference in position.
-                pos_diff = prev.get("position", 999) - curr.get("position", 999)
-                # Use a simple adaptive threshold: trigger an event if a driver gains at least one position.
-                if pos_diff >= 1:
-                    description = (f"{curr.get('name')} moved from position {prev.get('position')} "
-                                   f"to {curr.get('position')} at lap progress {curr.get('lap_percent', 0):.2f}.")
-                    self._add_event("overtake", description, curr.get("name"), curr.get("lap_percent"))
-                    detected_events.append({
-                        "type": "overtake",
-                        "description": description,
-                        "driver": curr.get("name"),
-                        "lap_percent": curr.get("lap_percent", 0),
-                        "timestamp": time.time()
-                    })
-        return detected_events
-
-    def _detect_stopped(self):
-        """
-        Detect if a driver appears to have stopped by comparing progress in total distance.
-        Uses a threshold that can be adjusted based on track length or average speeds.
-        """
-        detected_events = []
-        if not common.prev_drivers:
-            return detected_events
-
-        for curr in common.drivers:
-            prev = next((d for d in common.prev_drivers if d.get("name") == curr.get("name")), None)
-            if not prev:
-                continue
-
-            # Calculate the difference in total distance covered.
-            distance_diff = curr.get("total_dist", 0) - prev.get("total_dist", 0)
-            # Adaptive threshold: here we use 1.0 as a placeholder; in practice, this might depend on track length.
-            if distance_diff < 1.0:
-                description = f"{curr.get('name')} shows minimal progress in distance, possibly stopped."
-                self._add_event("stopped", description, curr.get("name"), curr.get("lap_percent", 0))
-                detected_events.append({
-                    "type": "stopped",
-                    "description": description,
-                    "driver": curr.get("name"),
-                    "lap_percent": curr.get("lap_percent", 0),
-                    "timestamp": time.time()
-                })
-        return detected_events
+    def reset(self):
+        """
+        Forget the event history and every detector's state, e.g., when a new session starts.
+        """
+        self.history.clear()
+        self.registry.reset()
 
     def get_events(self):
         """
-        Retrieve and return the combined list of detected events, sorted by timestamp.
-        After retrieval, the internal event list is refreshed.
+        Retrieve and return the new events detected this tick, sorted by timestamp.
+        Every enabled detector in the registry runs over the current and previous snapshots in
+        one pass. Events repeating one already in the history's dedup window are dropped, and the
+        rest are appended to the history.
         """
-        events_overtake = self._detect_overtakes()
-        events_stopped = self._detect_stopped()
-        all_events = events_overtake + events_stopped
+        curr, prev = self.current, self.previous
+        if curr is None or prev is None:
+            return []
+        all_events = self.registry.run(detectors.TickContext(self, curr, prev))
         all_events.sort(key=lambda e: e["timestamp"], reverse=True)
-        # Optionally remove duplicates.
-        unique_events = self._remove_duplicates(all_events)
-        self.events = unique_events
-        return unique_events
+        return [event for event in all_events if self.history.add(event)]
+
+    def detector_stats(self):
+        """
+        Get the wall-clock time and hit counts of every registered detector.
+        """
+        return self.registry.stats()
+
+    def battle_focus(self):
+        """
+        Get the car idx of the chasing car in the closest battle on track.
+        :return: Car idx, or None if the battle detector is disabled or no cars are battling.
+        """
+        battle = self.registry.detectors.get("battle")
+        if battle is None or not self.registry.enabled["battle"] or battle.focus < 0:
+            return None
+        return battle.focus
+
+    def score(self, event):
+        """
+        Score an event's importance against the current snapshot (see priority.score_event).
+        :param event: Event dictionary or summary event.
+        :return: Priority score.
+        """
+        curr = self.current
+        if curr is None:
+            return priority.score_event(event, 0, event.get("session_time") or 0.0)
+
+        # The longest battle either car involved has been in
+        battle_duration = 0.0
+        battle = self.registry.detectors.get("battle")
+        if battle is not None and self.registry.enabled["battle"]:
+            for e in event.get("events") or [event]:
+                for car_idx in (e.get("car_idx"), e.get("target_idx")):
+                    battle_duration = max(battle_duration, battle.battle_duration(car_idx, curr.session_time))
+        return priority.score_event(event, len(curr.car_indices()), curr.session_time, battle_duration)
 
-    def _remove_duplicates(self, events):
+    def events_since(self, session_time):
         """
-        Remove events with duplicate descriptions.
+        Get the events in the history at or after a session time, oldest first.
         """
-        seen = set()
-        unique = []
-        for event in events:
-            desc = event.get("description", "")
-            if desc not in seen:
-                unique.append(event)
-                seen.add(desc)
-        return unique
+        return self.history.since(session_time)
 
     def update_previous_drivers(self):
         """
-        Update the previous driver snapshot with the current driver state.
+        Make the current snapshot the previous one by swapping the double buffer's slots.
+        The next tick is then written over the old previous snapshot in place.
         """
-        common.prev_drivers = deepcopy(common.drivers)
+        if common.snapshots:
+            common.snapshots.swap()
 
 
-# For testing purposes:
+# Benchmark of per-tick detection cost for a 64-car field:
 if __name__ == "__main__":
-    import time
-
-    # Simulate previous telemetry data.
-    common.prev_drivers = [
-        {"name": "Driver A", "position": 2, "lap_percent": 0.70, "total_dist": 500},
-        {"name": "Driver B", "position": 1, "lap_percent": 0.72, "total_dist": 510},
-        {"name": "Driver C", "position": 3, "lap_percent": 0.65, "total_dist": 490}
-    ]
-    # Simulate updated telemetry data.
-    common.drivers = [
-        {"name": "Driver A", "position": 1, "lap_percent": 0.75, "total_dist": 505},
-        {"name": "Driver B", "position": 2, "lap_percent": 0.73, "total_dist": 512},
-        {"name": "Driver C", "position": 3, "lap_percent": 0.66, "total_dist": 492}
-    ]
-    
-    events_detector = Events()
-    detected = events_detector.get_events()
-    for event in detected:
-        print(event)
+    import timeit
+
+    num_cars = telemetry.MAX_CARS
+    rng = np.random.default_rng(0)
+    common.driver_names = [f"Driver {i}" for i in range(num_cars)]
+
+    # Build two consecutive snapshots with a few position swaps.
+    common.snapshots = telemetry.SnapshotBuffer(num_cars)
+    prev = common.snapshots.current
+    prev.session_time = 100.0
+    prev.track_surface[:] = telemetry.ON_TRACK
+    prev.lap[:] = 10
+    prev.lap_pct[:] = rng.random(num_cars)
+    prev.position[:] = np.arange(1, num_cars + 1)
+    prev.update_derived()
+    common.snapshots.swap()
+    curr = common.snapshots.current
+    curr.copy_from(prev)
+    curr.session_time = 100.1
+    curr.lap_pct += 0.001
+    curr.position[[4, 5]] = curr.position[[5, 4]]
+    curr.update_derived()
+
+    # The previous implementation: one dict per driver, matched on name.
+    def to_drivers(snapshot):
+        return [
+            {"name": common.driver_names[i], "position": int(snapshot.position[i]),
+             "lap_percent": float(snapshot.lap_pct[i]),
+             "total_dist": float(snapshot.total_dist[i]) * 5000}
+            for i in snapshot.car_indices()
+        ]
+
+    drivers, prev_drivers = to_drivers(curr), to_drivers(prev)
+
+    def legacy_detect():
+        detected = []
+        for current in drivers:
+            previous = next((d for d in prev_drivers if d.get("name") == current.get("name")), None)
+            if previous and current.get("position", 999) < previous.get("position", 999):
+                detected.append(("overtake", current.get("name")))
+        for current in drivers:
+            previous = next((d for d in prev_drivers if d.get("name") == current.get("name")), None)
+            if previous and current.get("total_dist", 0) - previous.get("total_dist", 0) < 1.0:
+                detected.append(("stopped", current.get("name")))
+        return detected
+
+    detector = Events()
+    iterations = 5000
+    legacy = timeit.timeit(legacy_detect, number=iterations) / iterations
+    legacy_with_dicts = timeit.timeit(
+        lambda: (to_drivers(curr), legacy_detect()), number=iterations
+    ) / iterations
+    vectorized = timeit.timeit(detector.get_events, number=iterations) / iterations
+
+    print(f"Name-matched dict detection:          {legacy * 1e6:8.1f} us/tick")
+    print(f"  including building driver dicts:    {legacy_with_dicts * 1e6:8.1f} us/tick")
+    print(f"Car idx vectorized detection:         {vectorized * 1e6:8.1f} us/tick")
+    print(f"Detected: {[e['description'] for e in detector.events]}")
+    for name, stats in detector.detector_stats().items():
+        print(f"  {name:10s} {stats['mean_time'] * 1e6:6.1f} us/tick, {stats['hits']} hits")
@@ -0,0 +1,136 @@
+"""
+Module: frame_codec.py
+
+This module packs a field snapshot's per-car arrays into compact binary
+frames for storage. Each frame is delta-encoded against the most recent
+keyframe: integers as differences and floats as the XOR of their bit
+patterns, so values that barely changed become runs of zero bytes. The bytes
+are then shuffled (all first bytes, then all second bytes, and so on) to put
+those zeros next to each other, and compressed with zlib.
+
+Because every frame is encoded against a keyframe rather than the frame
+before it, any frame can be decoded from itself and its keyframe alone.
+"""
+
+import zlib
+
+import numpy as np
+
+from core import telemetry
+
+# The per-car arrays stored in a frame, and the unsigned integer type each is
+# encoded as (a view of the same bytes)
+FRAME_FIELDS = (
+    ("position", np.int32, np.uint32),
+    ("lap", np.int32, np.uint32),
+    ("lap_pct", np.float32, np.uint32),
+    ("on_pit_road", np.bool_, np.uint8),
+    ("track_surface", np.int32, np.uint32),
+)
+
+# Fields whose bit patterns are XORed against the keyframe instead of subtracted
+XOR_FIELDS = ("lap_pct",)
+
+
+def _shuffle(data, itemsize):
+    """Group the bytes of fixed-size items by their position in the item."""
+    if itemsize == 1:
+        return data
+    return data.reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(data, itemsize):
+    """Undo _shuffle()."""
+    if itemsize == 1:
+        return data
+    return np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+def encode(snapshot, keyframe=None, level=1):
+    """Encode a snapshot's per-car arrays into a compressed frame.
+
+    Args:
+        snapshot (FieldSnapshot): The snapshot to encode.
+        keyframe (dict): The arrays of the keyframe to encode against, as
+            returned by decode(), or None to encode a keyframe.
+        level (int): The zlib compression level.
+
+    Returns:
+        bytes: The compressed frame.
+    """
+    parts = []
+    for field, dtype, code in FRAME_FIELDS:
+        values = getattr(snapshot, field).astype(dtype, copy=False).view(code)
+        if keyframe is not None:
+            base = keyframe[field].astype(dtype, copy=False).view(code)
+            if field in XOR_FIELDS:
+                values = np.bitwise_xor(values, base)
+            else:
+                values = values - base
+        raw = np.ascontiguousarray(values).view(np.uint8)
+        parts.append(_shuffle(raw, np.dtype(code).itemsize))
+    return zlib.compress(b"".join(parts), level)
+
+
+def decode(blob, num_cars, keyframe=None):
+    """Decode a compressed frame into per-car arrays.
+
+    Args:
+        blob (bytes): The compressed frame.
+        num_cars (int): The number of car slots in the frame.
+        keyframe (dict): The arrays of the frame's keyframe, or None if the
+            frame is itself a keyframe.
+
+    Returns:
+        dict: The frame's arrays, keyed by FieldSnapshot field name.
+    """
+    data = zlib.decompress(blob)
+    arrays = {}
+    offset = 0
+    for field, dtype, code in FRAME_FIELDS:
+        size = np.dtype(code).itemsize * num_cars
+        raw = _unshuffle(data[offset:offset + size], np.dtype(code).itemsize)
+        values = np.frombuffer(raw, dtype=code)
+        offset += size
+        if keyframe is not None:
+            base = keyframe[field].astype(dtype, copy=False).view(code)
+            if field in XOR_FIELDS:
+                values = np.bitwise_xor(values, base)
+            else:
+                values = values + base
+        arrays[field] = values.view(dtype).copy()
+    return arrays
+
+
+def arrays_of(snapshot):
+    """Copy a snapshot's stored arrays, for use as a keyframe.
+
+    Args:
+        snapshot (FieldSnapshot): The snapshot.
+
+    Returns:
+        dict: Copies of the arrays, keyed by field name.
+    """
+    return {field: getattr(snapshot, field).astype(dtype) for field, dtype, _ in FRAME_FIELDS}
+
+
+def to_snapshot(arrays, tick=0, session_time=0.0, snapshot=None):
+    """Fill a field snapshot from decoded arrays.
+
+    Args:
+        arrays (dict): The decoded arrays.
+        tick (int): The frame's tick.
+        session_time (float): The frame's session time.
+        snapshot (FieldSnapshot): The snapshot to fill, or None for a new one.
+
+    Returns:
+        FieldSnapshot: The snapshot, with its derived arrays recomputed.
+    """
+    if snapshot is None:
+        snapshot = telemetry.FieldSnapshot(len(arrays["position"]))
+    snapshot.tick = tick
+    snapshot.session_time = session_time
+    for field, _, _ in FRAME_FIELDS:
+        np.copyto(getattr(snapshot, field), arrays[field])
+    snapshot.update_derived()
+    return snapshot
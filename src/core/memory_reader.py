@@ -0,0 +1,422 @@
+"""
+Module: memory_reader.py
+
+This module reads iRacing telemetry straight out of the shared-memory buffer
+without going through pyirsdk's per-access unpacking. Variable offsets are
+resolved from the header once at startup, and NumPy views are created over
+every rotating variable buffer in the memory map. Reading a tick is then a
+matter of picking the latest buffer and copying its views into a snapshot.
+
+The reader works on the live iRacing memory map on Windows, or on any plain
+file laid out in the same format (see create_test_file).
+"""
+
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from core import telemetry
+
+# Name and size of the memory map iRacing publishes while running
+MEMMAPFILE = "Local\\IRSDKMemMapFileName"
+MEMMAPFILESIZE = 1164 * 1024
+
+# Header layout: 10 ints, 2 ints of padding, then up to 4 var buffers of
+# (tick_count, buf_offset, pad, pad)
+HEADER_INTS = 12
+VAR_BUF_INTS = 4
+MAX_BUFS = 4
+HEADER_SIZE = (HEADER_INTS + VAR_BUF_INTS * MAX_BUFS) * 4
+
+# Each variable header is type, offset, count, count_as_time + 3 pad bytes,
+# then the name, description and unit strings
+VAR_HEADER = struct.Struct("<3i?3x32s64s32s")
+
+# Bit set in the status field while iRacing is connected
+STATUS_CONNECTED = 1
+
+# irsdk_VarType values mapped to NumPy dtypes
+VAR_TYPES = {
+    0: np.dtype("S1"),
+    1: np.dtype(np.bool_),
+    2: np.dtype("<i4"),
+    3: np.dtype("<u4"),
+    4: np.dtype("<f4"),
+    5: np.dtype("<f8"),
+}
+
+# Header field positions, as int32 indices into the header
+_VER, _STATUS, _TICK_RATE = 0, 1, 2
+_SESSION_INFO_UPDATE, _SESSION_INFO_LEN, _SESSION_INFO_OFFSET = 3, 4, 5
+_NUM_VARS, _VAR_HEADER_OFFSET, _NUM_BUF, _BUF_LEN = 6, 7, 8, 9
+
+
+class SharedMemoryReader:
+    """Zero-copy access to the iRacing telemetry memory map.
+
+    After startup, every variable is available as one NumPy view per rotating
+    buffer. These views are created once, so reading the latest tick does not
+    allocate any Python objects beyond the copy into the caller's arrays.
+    """
+
+    def __init__(self, path=None):
+        """Initialize the reader.
+
+        Args:
+            path (str): Optional path to a file in the iRacing memory map
+                format. If None, the live iRacing memory map is used.
+        """
+        self.path = path
+        self.is_initialized = False
+        self.vars = {}
+        self._mmap = None
+        self._file = None
+        self._header = None
+        self._ticks = None
+        self._views = {}
+        self._car_views = []
+        self._bound = None
+
+    def startup(self):
+        """Open the memory map and resolve every variable from the header.
+
+        Returns:
+            bool: True if the memory map was opened, False otherwise.
+        """
+        self.shutdown()
+        try:
+            if self.path:
+                self._file = open(self.path, "rb")
+                self._mmap = mmap.mmap(
+                    self._file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+            else:
+                self._mmap = mmap.mmap(
+                    0, MEMMAPFILESIZE, MEMMAPFILE, access=mmap.ACCESS_READ
+                )
+        except (OSError, TypeError, ValueError):
+            self.shutdown()
+            return False
+
+        self._header = np.frombuffer(
+            self._mmap, dtype="<i4", count=HEADER_SIZE // 4
+        )
+        self._resolve_vars()
+        self.is_initialized = True
+        return True
+
+    def shutdown(self):
+        """Release every view and close the memory map.
+
+        Arrays returned by __getitem__ or view() point into the memory map.
+        If a caller still holds one, the map cannot be closed yet; it is
+        left for the garbage collector to close once the last array is
+        released, so shutdown, and a later startup, still succeed.
+        """
+        # Views must be dropped before the mmap they point into is closed
+        self.vars = {}
+        self._views = {}
+        self._car_views = []
+        self._bound = None
+        self._header = None
+        self._ticks = None
+        self.is_initialized = False
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _resolve_vars(self):
+        """Parse the variable headers and create a view per var buffer."""
+        header = self._header
+        num_buf = min(int(header[_NUM_BUF]), MAX_BUFS)
+        buf_offsets = [
+            int(header[HEADER_INTS + i * VAR_BUF_INTS + 1])
+            for i in range(num_buf)
+        ]
+
+        # Strided view over the tick counts of the active buffers
+        self._ticks = header[HEADER_INTS:HEADER_INTS + num_buf * VAR_BUF_INTS:
+                             VAR_BUF_INTS]
+
+        offset = int(header[_VAR_HEADER_OFFSET])
+        for _ in range(int(header[_NUM_VARS])):
+            var_type, var_offset, count, _, name, _, _ = \
+                VAR_HEADER.unpack_from(self._mmap, offset)
+            offset += VAR_HEADER.size
+
+            name = name.split(b"\0", 1)[0].decode("latin-1")
+            dtype = VAR_TYPES.get(var_type)
+            if dtype is None:
+                continue
+            self.vars[name] = (dtype, var_offset, count)
+            self._views[name] = [
+                np.frombuffer(
+                    self._mmap, dtype=dtype, count=count,
+                    offset=buf_offset + var_offset
+                )
+                for buf_offset in buf_offsets
+            ]
+
+    @property
+    def is_connected(self):
+        """Whether iRacing reports itself as connected."""
+        if self._header is None:
+            return False
+        return bool(self._header[_STATUS] & STATUS_CONNECTED)
+
+    @property
+    def tick_rate(self):
+        """The rate iRacing writes telemetry at, in ticks per second."""
+        return int(self._header[_TICK_RATE])
+
+    @property
+    def session_info_update(self):
+        """Counter incremented each time the session info string changes."""
+        return int(self._header[_SESSION_INFO_UPDATE])
+
+    def latest_index(self):
+        """Get the index of the var buffer holding the most recent tick.
+
+        Returns:
+            int: The buffer index.
+        """
+        return int(self._ticks.argmax())
+
+    def view(self, name, index=None):
+        """Get a read-only view of a variable in a var buffer.
+
+        Args:
+            name (str): The iRacing variable name.
+            index (int): The var buffer to view. Defaults to the latest.
+
+        Returns:
+            numpy.ndarray: A view over the memory map, or None if the
+                variable does not exist.
+        """
+        views = self._views.get(name)
+        if views is None:
+            return None
+        if index is None:
+            index = self.latest_index()
+        return views[index]
+
+    def __getitem__(self, name):
+        """Get a variable's current value, in the same shape as pyirsdk.
+
+        Scalars are returned as Python values; arrays as read-only views.
+
+        Args:
+            name (str): The iRacing variable name.
+
+        Returns:
+            The variable's value, or None if it does not exist.
+        """
+        view = self.view(name)
+        if view is None:
+            return None
+        if len(view) == 1:
+            return view[0].item()
+        return view
+
+    def bind(self, snapshot):
+        """Precompute the view/array pairs used to fill a snapshot.
+
+        Args:
+            snapshot (FieldSnapshot): The snapshot read_into will write to.
+        """
+        self._car_views = []
+        for attr, var_name in telemetry.CAR_FIELDS.items():
+            views = self._views.get(var_name)
+            if views is None:
+                continue
+            target = getattr(snapshot, attr)
+            count = min(len(target), len(views[0]))
+            self._car_views.append((
+                target[:count], [view[:count] for view in views]
+            ))
+        self._bound = snapshot
+
+    def read_into(self, snapshot, retries=3):
+        """Copy the latest tick's CarIdx arrays into a snapshot.
+
+        iRacing keeps writing while we copy, so the buffer's tick count is
+        checked before and after the copy, and the copy is retried if the
+        buffer was rotated underneath us.
+
+        Args:
+            snapshot (FieldSnapshot): The snapshot to overwrite.
+            retries (int): How many times to retry a torn read.
+
+        Returns:
+            bool: True if the snapshot was updated, False if iRacing is not
+                connected.
+        """
+        if not self.is_connected:
+            return False
+        if self._bound is not snapshot:
+            self.bind(snapshot)
+
+        ticks = self._ticks
+        tick_views = self._views.get("SessionTick")
+        time_views = self._views.get("SessionTime")
+        for _ in range(retries + 1):
+            index = int(ticks.argmax())
+            tick_count = ticks[index]
+            for target, views in self._car_views:
+                np.copyto(target, views[index], casting="unsafe")
+            if tick_views is not None:
+                snapshot.tick = int(tick_views[index][0])
+            if time_views is not None:
+                snapshot.session_time = float(time_views[index][0])
+            if ticks[index] == tick_count:
+                break
+
+        snapshot.update_derived()
+        return True
+
+
+def create_test_file(path, variables, tick_count=1, num_buf=3,
+                     session_info="", tick_rate=60):
+    """Write a file laid out like the iRacing telemetry memory map.
+
+    Every var buffer is filled with the same values, and the first buffer is
+    given the highest tick count. This is mainly useful for testing readers
+    without an iRacing install.
+
+    Args:
+        path (str): The file to write.
+        variables (dict): Maps variable names to (var_type, values) tuples,
+            where var_type is an irsdk_VarType value and values is a scalar
+            or a sequence.
+        tick_count (int): The tick count of the latest var buffer.
+        num_buf (int): The number of rotating var buffers.
+        session_info (str): The session info YAML string.
+        tick_rate (int): The tick rate written to the header.
+    """
+    # Lay out each variable in the buffer, aligned to its own size
+    layout = []
+    buf_len = 0
+    for name, (var_type, values) in variables.items():
+        dtype = VAR_TYPES[var_type]
+        values = np.atleast_1d(np.asarray(values, dtype=dtype))
+        buf_len += -buf_len % dtype.itemsize
+        layout.append((name, var_type, buf_len, values))
+        buf_len += values.nbytes
+    buf_len += -buf_len % 16
+
+    var_header_offset = HEADER_SIZE
+    session_info_bytes = session_info.encode("latin-1") + b"\0"
+    session_info_offset = var_header_offset + VAR_HEADER.size * len(layout)
+    first_buf_offset = session_info_offset + len(session_info_bytes)
+    first_buf_offset += -first_buf_offset % 16
+    size = max(first_buf_offset + buf_len * num_buf, MEMMAPFILESIZE)
+
+    data = bytearray(size)
+    header = np.frombuffer(data, dtype="<i4", count=HEADER_SIZE // 4)
+    header[_VER] = 2
+    header[_STATUS] = STATUS_CONNECTED
+    header[_TICK_RATE] = tick_rate
+    header[_SESSION_INFO_UPDATE] = 1
+    header[_SESSION_INFO_LEN] = len(session_info_bytes)
+    header[_SESSION_INFO_OFFSET] = session_info_offset
+    header[_NUM_VARS] = len(layout)
+    header[_VAR_HEADER_OFFSET] = var_header_offset
+    header[_NUM_BUF] = num_buf
+    header[_BUF_LEN] = buf_len
+    for i in range(num_buf):
+        header[HEADER_INTS + i * VAR_BUF_INTS] = tick_count - i
+        header[HEADER_INTS + i * VAR_BUF_INTS + 1] = \
+            first_buf_offset + i * buf_len
+
+    for i, (name, var_type, offset, values) in enumerate(layout):
+        VAR_HEADER.pack_into(
+            data, var_header_offset + i * VAR_HEADER.size,
+            var_type, offset, len(values), False,
+            name.encode("latin-1"), b"", b""
+        )
+        for buf in range(num_buf):
+            start = first_buf_offset + buf * buf_len + offset
+            data[start:start + values.nbytes] = values.tobytes()
+
+    data[session_info_offset:session_info_offset + len(session_info_bytes)] = \
+        session_info_bytes
+
+    # Release the header view before writing the buffer out
+    del header
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+# Microbenchmark against the pyirsdk ir["CarIdx..."] path:
+if __name__ == "__main__":
+    import tempfile
+    import timeit
+
+    num_cars = telemetry.MAX_CARS
+    variables = {
+        "SessionTick": (2, 1000),
+        "SessionTime": (5, 123.4),
+        "CarIdxPosition": (2, np.arange(num_cars)),
+        "CarIdxLap": (2, np.full(num_cars, 5)),
+        "CarIdxLapDistPct": (4, np.linspace(0.0, 1.0, num_cars)),
+        "CarIdxOnPitRoad": (1, np.zeros(num_cars, dtype=bool)),
+        "CarIdxTrackSurface": (2, np.full(num_cars, telemetry.ON_TRACK)),
+    }
+    session_info = "---\nDriverInfo:\n Drivers:\n...\n"
+    path = os.path.join(tempfile.mkdtemp(), "telemetry.bin")
+    create_test_file(path, variables, session_info=session_info)
+
+    iterations = 10000
+    snapshot = telemetry.FieldSnapshot(num_cars)
+    reader = SharedMemoryReader(path)
+    reader.startup()
+    zero_copy = timeit.timeit(lambda: reader.read_into(snapshot),
+                              number=iterations)
+    print(f"SharedMemoryReader.read_into: "
+          f"{zero_copy / iterations * 1e6:.2f} us/tick")
+
+    try:
+        import irsdk
+        ir = irsdk.IRSDK()
+        ir.startup(test_file=path)
+        label = "pyirsdk ir[...]"
+    except ImportError:
+        # Mimic pyirsdk's per-access struct unpacking when it isn't installed
+        class _UnpackingIR:
+            _formats = {0: "c", 1: "?", 2: "i", 3: "I", 4: "f", 5: "d"}
+
+            def __getitem__(self, name):
+                dtype, offset, count = reader.vars[name]
+                var_type = [k for k, v in VAR_TYPES.items() if v == dtype][0]
+                buf_offset = int(
+                    reader._header[HEADER_INTS + reader.latest_index() *
+                                   VAR_BUF_INTS + 1]
+                )
+                values = struct.unpack_from(
+                    self._formats[var_type] * count, reader._mmap,
+                    buf_offset + offset
+                )
+                return list(values) if count > 1 else values[0]
+
+        ir = _UnpackingIR()
+        label = "struct unpack (pyirsdk not installed)"
+
+    def read_pyirsdk():
+        snapshot.tick = ir["SessionTick"]
+        snapshot.session_time = ir["SessionTime"]
+        for attr, var_name in telemetry.CAR_FIELDS.items():
+            getattr(snapshot, attr)[:] = ir[var_name]
+        snapshot.update_derived()
+
+    unpacking = timeit.timeit(read_pyirsdk, number=iterations)
+    print(f"{label}: {unpacking / iterations * 1e6:.2f} us/tick")
+    print(f"Speedup: {unpacking / zero_copy:.1f}x")
+    reader.shutdown()
@@ -0,0 +1,377 @@
+"""
+Module: pipeline.py
+
+This module provides the building blocks for running the director as a set of
+stages on their own threads, connected by bounded queues. Each queue has an
+explicit policy for what happens when it is full, so a slow stage (such as
+commentary generation) can never stall the stages upstream of it.
+"""
+
+import collections
+import threading
+import time
+
+from core import common
+
+# Full-queue policies
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+# Returned by StageQueue.get once the queue is closed and empty
+CLOSED = object()
+
+# Seconds a producer stage waits after its first failed iteration; the wait
+# doubles with each further failure in a row, up to the maximum
+ERROR_BACKOFF = 0.1
+MAX_ERROR_BACKOFF = 5.0
+
+
+class StageQueue:
+    """A bounded queue between two stages.
+
+    When the queue is full, put() either blocks until there is room (BLOCK),
+    evicts the oldest item (DROP_OLDEST) or discards the new item
+    (DROP_NEWEST). The queue keeps counters so its depth and drops can be
+    monitored, and can hand every dropped item to a callback so resources
+    held by it are released.
+    """
+
+    def __init__(self, name, maxsize, policy=BLOCK, on_drop=None):
+        """Initialize the queue.
+
+        Args:
+            name (str): The queue name, used in metrics.
+            maxsize (int): The maximum number of queued items.
+            policy (str): BLOCK, DROP_OLDEST or DROP_NEWEST.
+            on_drop: Optional callable run with each item the queue drops,
+                whether evicted, refused or discarded on close. It is run
+                on the thread that caused the drop, outside the queue's lock.
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1.")
+        if policy not in (BLOCK, DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown queue policy: {policy}")
+
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_drop = on_drop
+        self.closed = False
+        self.puts = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+    def put(self, item, timeout=None):
+        """Add an item, applying the queue's policy if it is full.
+
+        Args:
+            item: The item to add.
+            timeout (float): For BLOCK queues, how long to wait for room
+                before dropping the item. None waits indefinitely.
+
+        Returns:
+            bool: True if the item was queued, False if it was dropped.
+        """
+        queued, dropped = self._put(item, timeout)
+        self._dropped(dropped)
+        return queued
+
+    def _put(self, item, timeout):
+        """Add an item under the lock.
+
+        Returns:
+            tuple: Whether the item was queued, and the list of items dropped.
+        """
+        with self._lock:
+            if self.closed:
+                return False, [item]
+
+            evicted = []
+            if len(self._items) >= self.maxsize:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False, [item]
+                if self.policy == DROP_OLDEST:
+                    evicted.append(self._items.popleft())
+                    self.dropped += 1
+                else:
+                    self._not_full.wait_for(
+                        lambda: len(self._items) < self.maxsize or self.closed,
+                        timeout
+                    )
+                    if self.closed or len(self._items) >= self.maxsize:
+                        self.dropped += 1
+                        return False, [item]
+
+            self._items.append(item)
+            self.puts += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._not_empty.notify()
+            return True, evicted
+
+    def _dropped(self, items):
+        """Hand dropped items to the on_drop callback."""
+        if self.on_drop:
+            for item in items:
+                self.on_drop(item)
+
+    def get(self, timeout=None):
+        """Remove and return the oldest item.
+
+        Args:
+            timeout (float): How long to wait for an item. None waits
+                indefinitely.
+
+        Returns:
+            The item, None on timeout, or CLOSED once the queue is closed and
+            empty.
+        """
+        with self._lock:
+            self._not_empty.wait_for(
+                lambda: self._items or self.closed, timeout
+            )
+            if self._items:
+                item = self._items.popleft()
+                self._not_full.notify()
+                return item
+            return CLOSED if self.closed else None
+
+    def close(self, discard=False):
+        """Stop accepting items and wake up any waiting threads.
+
+        Args:
+            discard (bool): Whether to drop the items still in the queue
+                instead of letting the consumer drain them.
+        """
+        discarded = []
+        with self._lock:
+            self.closed = True
+            if discard:
+                self.dropped += len(self._items)
+                discarded = list(self._items)
+                self._items.clear()
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        self._dropped(discarded)
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """Get the queue's metrics.
+
+        Returns:
+            dict: Current depth, capacity, maximum depth, puts and drops.
+        """
+        return {
+            "depth": len(self._items),
+            "maxsize": self.maxsize,
+            "max_depth": self.max_depth,
+            "puts": self.puts,
+            "dropped": self.dropped
+        }
+
+
+class Stage:
+    """A pipeline stage running on its own thread.
+
+    A consumer stage calls its target with every item taken from its inbox
+    until the inbox is closed and drained. A producer stage has no inbox and
+    calls its target repeatedly until the target returns False or the stage
+    is asked to stop. A producer whose target raises backs off before trying
+    again, and gives up after max_errors failures in a row.
+    """
+
+    def __init__(self, name, target, inbox=None, setup=None, teardown=None, max_errors=10):
+        """Initialize the stage.
+
+        Args:
+            name (str): The stage name, used for the thread and in metrics.
+            target: Called with each inbox item, or with no arguments for a
+                producer stage.
+            inbox (StageQueue): The queue to consume, or None for a producer.
+            setup: Optional callable run on the stage thread before the first
+                item, e.g. to open a thread-bound connection.
+            teardown: Optional callable run on the stage thread on exit.
+            max_errors (int): Failures in a row after which a producer stage
+                stops.
+        """
+        self.name = name
+        self.target = target
+        self.inbox = inbox
+        self.setup = setup
+        self.teardown = teardown
+        self.max_errors = max_errors
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the stage thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"director-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    def request_stop(self):
+        """Ask a producer stage to stop after its current iteration."""
+        self._stop_event.set()
+
+    def join(self, timeout=None):
+        """Wait for the stage thread to exit.
+
+        Args:
+            timeout (float): How long to wait, or None to wait indefinitely.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_alive(self):
+        """Whether the stage thread is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        """Stage thread body."""
+        try:
+            if self.setup:
+                self.setup()
+        except Exception as e:
+            # Without its setup the stage cannot run; close the inbox so the
+            # stages upstream drop their items instead of waiting for room
+            self.errors += 1
+            if common.app:
+                common.app.add_message(f"Error starting {self.name} stage: {str(e)}")
+            if self.inbox is not None:
+                self.inbox.close(discard=True)
+            return
+
+        failures = 0
+        try:
+            while not self._stop_event.is_set():
+                if self.inbox is None:
+                    errors = self.errors
+                    if self._call() is False:
+                        break
+                    if self.errors == errors:
+                        failures = 0
+                        continue
+
+                    # Back off instead of spinning on an error that repeats every call
+                    failures += 1
+                    if failures >= self.max_errors:
+                        if common.app:
+                            common.app.add_message(
+                                f"Stopping {self.name} stage after {failures} errors in a row."
+                            )
+                        break
+                    self._stop_event.wait(min(ERROR_BACKOFF * 2 ** (failures - 1), MAX_ERROR_BACKOFF))
+                    continue
+
+                item = self.inbox.get(timeout=0.5)
+                if item is CLOSED:
+                    break
+                if item is not None:
+                    self._call(item)
+        finally:
+            if self.teardown:
+                self.teardown()
+
+    def _call(self, *args):
+        """Run the target once, timing it and containing its errors."""
+        start = time.perf_counter()
+        try:
+            return self.target(*args)
+        except Exception as e:
+            self.errors += 1
+            if common.app:
+                common.app.add_message(f"Error in {self.name} stage: {str(e)}")
+        finally:
+            self.busy_time += time.perf_counter() - start
+            self.processed += 1
+
+    def stats(self):
+        """Get the stage's metrics.
+
+        Returns:
+            dict: Items processed, errors and total busy time in seconds.
+        """
+        return {
+            "processed": self.processed,
+            "errors": self.errors,
+            "busy_time": self.busy_time,
+            "alive": self.is_alive()
+        }
+
+
+class Pipeline:
+    """An ordered set of stages, started and stopped together.
+
+    Stages must be added upstream first. Stopping the pipeline stops the
+    producers, then closes each consumer's inbox in order, so every stage
+    drains (or discards) what the stages before it produced.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def add(self, stage, discard_on_stop=False):
+        """Add a stage downstream of the stages already added.
+
+        Args:
+            stage (Stage): The stage to add.
+            discard_on_stop (bool): Whether to drop the stage's queued items
+                on stop instead of processing them.
+        """
+        self.stages.append((stage, discard_on_stop))
+
+    def start(self):
+        """Start every stage."""
+        for stage, _ in self.stages:
+            stage.start()
+
+    def wait(self):
+        """Block until every producer stage has exited."""
+        for stage, _ in self.stages:
+            if stage.inbox is None:
+                stage.join()
+
+    def stop(self, timeout=10.0):
+        """Stop every stage in order, letting queues drain.
+
+        Args:
+            timeout (float): How long to wait for all the stages to exit.
+                Stages still running at the deadline are left to finish on
+                their own.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            for stage, discard in self.stages:
+                if stage.inbox is None:
+                    stage.request_stop()
+                else:
+                    stage.inbox.close(discard=discard)
+                if stage._thread is not threading.current_thread():
+                    stage.join(max(deadline - time.monotonic(), 0.0))
+
+    def stats(self):
+        """Get every stage's and queue's metrics.
+
+        Returns:
+            dict: Stage names mapped to their stage stats, with the inbox
+                stats under "queue" for consumer stages.
+        """
+        stats = {}
+        for stage, _ in self.stages:
+            stats[stage.name] = stage.stats()
+            if stage.inbox is not None:
+                stats[stage.name]["queue"] = stage.inbox.stats()
+        return stats
@@ -0,0 +1,175 @@
+"""
+Module: priority.py
+
+Event priority scoring and commentary admission for IntelliCaster.
+Every event is scored by how much it matters to the race: its type, the positions involved,
+whether the leader is involved, how long the battle behind it has lasted and how recent it is.
+Batches of scored events then pass through an AdmissionController, which enforces a maximum
+commentary rate and a character budget per minute with token buckets. Under load the controller
+raises the score an event needs, so low-value events are dropped rather than queued, and the
+OpenAI and ElevenLabs spend per minute has a hard ceiling.
+"""
+
+import math
+import threading
+import time
+
+# Base importance of each event type; unknown types score DEFAULT_WEIGHT
+TYPE_WEIGHTS = {
+    "incident": 1.0,
+    "overtake_chain": 0.9,
+    "overtake": 0.7,
+    "stopped": 0.7,
+    "off_track": 0.5,
+    "battle": 0.5,
+    "closing": 0.3,
+    "pit_entry": 0.3,
+    "pit_exit": 0.2,
+    "rejoin": 0.2
+}
+DEFAULT_WEIGHT = 0.2
+
+# Bonus for events involving the race leader
+LEADER_BONUS = 0.5
+
+# Battle length, in seconds, that earns the full battle bonus, and the bonus itself
+BATTLE_LENGTH_FULL = 60.0
+BATTLE_BONUS = 0.3
+
+# Seconds of session time over which an event's score halves
+RECENCY_HALF_LIFE = 10.0
+
+def score_event(event, field_size, session_time, battle_duration=0.0):
+    """
+    Score how much an event matters to the race.
+    :param event: Event dictionary, optionally with 'position' and 'target_position', or a summary
+        event with its original 'events'.
+    :param field_size: Number of cars in the field.
+    :param session_time: Current session time, for recency.
+    :param battle_duration: Seconds the battle involving the event's cars has lasted.
+    :return: Score, roughly 0 to 2.
+    """
+    members = event.get("events")
+    if members:
+        # A summary scores as its best event, plus a little for every other car involved
+        best = max(score_event(e, field_size, session_time, battle_duration) for e in members)
+        return best + 0.1 * (len(members) - 1)
+
+    score = TYPE_WEIGHTS.get(event.get("type"), DEFAULT_WEIGHT)
+
+    # Front-running cars matter more than the back of the field
+    positions = [p for p in (event.get("position"), event.get("target_position")) if p and p > 0]
+    if positions:
+        best_position = min(positions)
+        score *= 1.0 - 0.5 * (best_position - 1) / max(field_size, 1)
+        if best_position == 1:
+            score += LEADER_BONUS
+
+    score += BATTLE_BONUS * min(battle_duration / BATTLE_LENGTH_FULL, 1.0)
+
+    age = max(session_time - (event.get("session_time") or session_time), 0.0)
+    return score * math.pow(0.5, age / RECENCY_HALF_LIFE)
+
+class AdmissionController:
+    """
+    Token-bucket admission of batches of scored events to commentary.
+
+    One bucket holds commentary requests and refills at max_per_minute; the other holds characters
+    and refills at char_budget per minute. Admitting a batch reserves one request and an estimate of
+    its characters, and settle() corrects the estimate once the commentary text is known. As the
+    buckets empty, the score an event needs rises from min_priority towards 1, and a batch with no
+    events above it, or arriving when a bucket is empty, is dropped. Safe to use from several threads.
+    """
+
+    def __init__(self, max_per_minute=6, char_budget=3000, min_priority=0.3,
+                 chars_per_request=400, clock=time.monotonic):
+        """
+        :param max_per_minute: Most commentary requests per minute (and the burst size).
+        :param char_budget: Most characters of commentary per minute.
+        :param min_priority: Score an event needs with full buckets.
+        :param chars_per_request: Characters reserved for each admitted request.
+        :param clock: The monotonic clock function to use.
+        """
+        self.max_per_minute = float(max_per_minute)
+        self.char_budget = float(char_budget)
+        self.min_priority = min_priority
+        self.chars_per_request = chars_per_request
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._requests = self.max_per_minute
+        self._chars = self.char_budget
+        self._last = clock()
+
+        self.admitted = 0
+        self.dropped_batches = 0
+        self.dropped_events = 0
+
+    def _refill(self):
+        """
+        Refill both buckets for the time since the last refill.
+        """
+        now = self._clock()
+        minutes = (now - self._last) / 60.0
+        self._last = now
+        self._requests = min(self._requests + minutes * self.max_per_minute, self.max_per_minute)
+        self._chars = min(self._chars + minutes * self.char_budget, self.char_budget)
+
+    def threshold(self):
+        """
+        The score an event needs to be admitted right now.
+        """
+        with self._lock:
+            self._refill()
+            return self._threshold()
+
+    def _threshold(self):
+        fill = min(self._requests / max(self.max_per_minute, 1e-9),
+                   self._chars / max(self.char_budget, 1e-9))
+        return self.min_priority + (1.0 - fill) * (1.0 - self.min_priority)
+
+    def admit(self, batch):
+        """
+        Decide whether a batch of events gets commentary.
+        :param batch: List of event dictionaries with a 'priority' score.
+        :return: The events worth commentating on, highest priority first, or an empty list if
+            the batch was dropped.
+        """
+        with self._lock:
+            self._refill()
+            threshold = self._threshold()
+            kept = sorted((e for e in batch if e.get("priority", 0.0) >= threshold),
+                          key=lambda e: e.get("priority", 0.0), reverse=True)
+
+            if not kept or self._requests < 1.0 or self._chars < self.chars_per_request:
+                self.dropped_batches += 1
+                self.dropped_events += len(batch)
+                return []
+
+            self._requests -= 1.0
+            self._chars -= self.chars_per_request
+            self.admitted += 1
+            self.dropped_events += len(batch) - len(kept)
+            return kept
+
+    def settle(self, chars):
+        """
+        Charge an admitted request's actual characters instead of the reserved estimate.
+        :param chars: Length of the commentary text generated (0 if the request failed).
+        """
+        with self._lock:
+            self._chars = min(self._chars + self.chars_per_request - chars, self.char_budget)
+
+    def stats(self):
+        """
+        Get the admission counts and the current state of the buckets.
+        """
+        with self._lock:
+            self._refill()
+            return {
+                "admitted": self.admitted,
+                "dropped_batches": self.dropped_batches,
+                "dropped_events": self.dropped_events,
+                "requests_available": self._requests,
+                "chars_available": self._chars,
+                "threshold": self._threshold()
+            }
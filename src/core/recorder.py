@@ -0,0 +1,301 @@
+"""
+Module: recorder.py
+
+This module records field snapshots to a compact, append-only binary file and
+replays them back into the director. Session archives exported from the
+database (see session_archive.py) can be replayed the same way. Every frame is
+a fixed-width record, so a recording can be memory-mapped as a NumPy
+structured array and any frame can be read by index without parsing the
+frames before it.
+
+File layout:
+    A fixed-size header holding a magic string, the format version, the
+    number of car slots and a JSON metadata block (driver names, frame
+    count), followed by the frame records back to back. The metadata is only
+    filled in when the recorder is closed, so readers take the frame count
+    from the file size instead, and a recording cut short by a crash still
+    replays up to its last complete frame.
+"""
+
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from core import session_archive, telemetry
+
+# File identification
+MAGIC = b"ICTELEM\0"
+VERSION = 1
+
+# Size reserved at the start of the file for the header and metadata
+HEADER_SIZE = 4096
+_HEADER = struct.Struct("<8sII")
+
+
+def record_dtype(num_cars):
+    """Get the structured dtype of one recorded frame.
+
+    Args:
+        num_cars (int): The number of car slots per frame.
+
+    Returns:
+        numpy.dtype: The record dtype.
+    """
+    return np.dtype([
+        ("tick", "<i4"),
+        ("session_time", "<f8"),
+        ("position", "<i4", (num_cars,)),
+        ("lap", "<i4", (num_cars,)),
+        ("lap_pct", "<f4", (num_cars,)),
+        ("on_pit_road", "?", (num_cars,)),
+        ("track_surface", "<i4", (num_cars,)),
+    ])
+
+
+def _write_header(file, num_cars, metadata):
+    """Write the header block at the start of a recording.
+
+    Args:
+        file: The file object, opened for binary writing.
+        num_cars (int): The number of car slots per frame.
+        metadata (dict): JSON serializable metadata to store.
+    """
+    encoded = json.dumps(metadata).encode("utf-8")
+    if _HEADER.size + len(encoded) > HEADER_SIZE:
+        raise ValueError("Recording metadata does not fit in the header.")
+    header = _HEADER.pack(MAGIC, VERSION, num_cars) + encoded
+    file.seek(0)
+    file.write(header.ljust(HEADER_SIZE, b"\0"))
+
+
+def session_path(path, session_id):
+    """Get the file to record one director session to.
+
+    Args:
+        path (str): The configured recording path, e.g. "race.ictel".
+        session_id (int): The database session being recorded.
+
+    Returns:
+        str: The path with the session id before its extension, e.g.
+            "race-12.ictel", so a restarted director keeps earlier recordings.
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}-{session_id}{ext}"
+
+
+class TelemetryRecorder:
+    """Append field snapshots to a recording file.
+
+    Each call to write() appends exactly one fixed-width record. The header
+    is rewritten with the driver names and frame count when the recorder is
+    closed, but the records themselves are never modified.
+    """
+
+    def __init__(self, path, num_cars=telemetry.MAX_CARS):
+        """Create the recording file.
+
+        Args:
+            path (str): The file to record to. It is overwritten.
+            num_cars (int): The number of car slots per frame.
+        """
+        self.path = path
+        self.num_cars = num_cars
+        self.frames = 0
+        self._record = np.zeros(1, dtype=record_dtype(num_cars))
+        self._file = open(path, "wb")
+        _write_header(self._file, num_cars, {"names": [], "frames": 0})
+
+    def write(self, snapshot):
+        """Append a snapshot to the recording.
+
+        Args:
+            snapshot (FieldSnapshot): The snapshot to record.
+        """
+        record = self._record[0]
+        record["tick"] = snapshot.tick
+        record["session_time"] = snapshot.session_time
+        for attr in telemetry.CAR_FIELDS:
+            record[attr] = getattr(snapshot, attr)
+        self._file.write(self._record.data)
+        self.frames += 1
+
+    def close(self, names=None):
+        """Finalize the header and close the file.
+
+        Args:
+            names (list): Driver names indexed by car idx.
+        """
+        if self._file is None:
+            return
+        self._file.flush()
+        _write_header(self._file, self.num_cars, {
+            "names": list(names) if names else [],
+            "frames": self.frames
+        })
+        self._file.close()
+        self._file = None
+
+
+class TelemetryRecording:
+    """A memory-mapped, read-only view of a recording file.
+
+    Attributes:
+        frames (numpy.memmap): The recorded frames as a structured array.
+        names (list): Driver names indexed by car idx.
+        num_cars (int): The number of car slots per frame.
+    """
+
+    def __init__(self, path):
+        """Open a recording.
+
+        Args:
+            path (str): The recording file.
+        """
+        with open(path, "rb") as file:
+            header = file.read(HEADER_SIZE)
+        magic, version, num_cars = _HEADER.unpack_from(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a telemetry recording.")
+        metadata = json.loads(
+            header[_HEADER.size:].rstrip(b"\0").decode("utf-8")
+        )
+
+        self.path = path
+        self.num_cars = num_cars
+        self.names = metadata.get("names") or [""] * num_cars
+
+        # Ignore a partially written last record, e.g. after a crash
+        dtype = record_dtype(num_cars)
+        count = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+        if count > 0:
+            self.frames = np.memmap(
+                path, dtype=dtype, mode="r", offset=HEADER_SIZE,
+                shape=(count,)
+            )
+        else:
+            self.frames = np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame_time(self, index):
+        """Get the session time of a recorded frame.
+
+        Args:
+            index (int): The frame.
+
+        Returns:
+            float: The frame's session time.
+        """
+        return float(self.frames[index]["session_time"])
+
+    def read_frame(self, index, snapshot):
+        """Copy a recorded frame into a snapshot.
+
+        Args:
+            index (int): The frame to read.
+            snapshot (FieldSnapshot): The snapshot to overwrite.
+        """
+        record = self.frames[index]
+        snapshot.tick = int(record["tick"])
+        snapshot.session_time = float(record["session_time"])
+        for attr in telemetry.CAR_FIELDS:
+            np.copyto(getattr(snapshot, attr), record[attr])
+        snapshot.update_derived()
+
+
+def open_recording(path):
+    """Open a recording file, or a session archive directory.
+
+    Args:
+        path (str): The recording file or archive directory.
+
+    Returns:
+        TelemetryRecording or SessionArchive: The recording.
+    """
+    if os.path.isdir(path):
+        return session_archive.SessionArchive(path)
+    return TelemetryRecording(path)
+
+
+class ReplaySource(telemetry.TelemetrySource):
+    """Feed a recording back to the director as if it were live.
+
+    Frames are paced by their recorded session time divided by the replay
+    speed. A speed of 0 replays unthrottled, as fast as the consumer reads.
+    """
+
+    paced = True
+
+    def __init__(self, path, speed=1.0):
+        """Open a recording for replay.
+
+        Args:
+            path (str): The recording file, or a session archive directory.
+            speed (float): The replay speed multiplier, or 0 for unthrottled.
+        """
+        self.recording = open_recording(path)
+        super().__init__(self.recording.num_cars)
+        self.names = self.recording.names
+        self.speed = speed
+        self.index = 0
+        self._start_wall = None
+        self._start_session = 0.0
+
+    @property
+    def finished(self):
+        """True once every frame has been replayed."""
+        return self.index >= len(self.recording)
+
+    def read(self, snapshot):
+        """Read the next recorded frame, waiting until it is due.
+
+        Args:
+            snapshot (FieldSnapshot): The snapshot to overwrite.
+
+        Returns:
+            bool: True if the snapshot was updated, False at the end of the
+                recording.
+        """
+        if self.finished:
+            return False
+
+        if self.speed > 0:
+            session_time = self.recording.frame_time(self.index)
+            if self._start_wall is None:
+                self._start_wall = time.monotonic()
+                self._start_session = session_time
+            due = self._start_wall + (session_time - self._start_session) / self.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        self.recording.read_frame(self.index, snapshot)
+        self.index += 1
+        return True
+
+
+# For testing purposes:
+if __name__ == "__main__":
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), "race.ictel")
+    snapshot = telemetry.FieldSnapshot()
+    recorder = TelemetryRecorder(path)
+    for tick in range(36000):
+        snapshot.tick = tick
+        snapshot.session_time = tick / 60
+        snapshot.lap_pct[:] = (tick / 6000 + np.arange(64) / 64) % 1.0
+        recorder.write(snapshot)
+    recorder.close(names=[f"Driver {i}" for i in range(64)])
+
+    source = ReplaySource(path, speed=0)
+    start = time.perf_counter()
+    while source.read(snapshot):
+        pass
+    elapsed = time.perf_counter() - start
+    print(f"Replayed {len(source.recording)} frames "
+          f"({os.path.getsize(path) / 1e6:.1f} MB) in {elapsed:.3f} s")
@@ -0,0 +1,166 @@
+"""
+Module: scheduler.py
+
+This module provides a drift-free fixed-rate tick scheduler. Deadlines are
+kept on a fixed grid of the monotonic clock (start + n * period), so the time
+spent doing work inside a tick does not push later ticks back. Ticks that run
+longer than the period are counted, and the scheduler either skips the missed
+ticks or catches up on them depending on its policy.
+"""
+
+import asyncio
+import time
+
+import numpy as np
+
+# Overrun policies
+SKIP = "skip"
+CATCH_UP = "catch_up"
+
+# Number of recent ticks kept for jitter and work time percentiles
+HISTORY_LEN = 1024
+
+
+class TickScheduler:
+    """Hold a loop to a fixed tick rate.
+
+    Call start() once before the first tick and wait() at the end of every
+    tick. With the skip policy, a late tick causes the missed grid slots to be
+    dropped and the next tick to start on the next future slot. With the
+    catch_up policy, missed ticks are run back to back without sleeping,
+    up to max_catch_up of them.
+    """
+
+    def __init__(self, period, policy=SKIP, max_catch_up=10,
+                 clock=time.monotonic, sleep=time.sleep):
+        """Initialize the scheduler.
+
+        Args:
+            period (float): The tick period in seconds.
+            policy (str): SKIP or CATCH_UP.
+            max_catch_up (int): The most missed ticks to catch up on at once;
+                any beyond that are skipped.
+            clock: The monotonic clock function to use.
+            sleep: The sleep function to use.
+        """
+        if period <= 0:
+            raise ValueError("The tick period must be positive.")
+        if policy not in (SKIP, CATCH_UP):
+            raise ValueError(f"Unknown overrun policy: {policy}")
+
+        self.period = period
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+        self._clock = clock
+        self._sleep = sleep
+
+        self.ticks = 0
+        self.late_ticks = 0
+        self.skipped_ticks = 0
+        self._jitter = np.zeros(HISTORY_LEN)
+        self._work = np.zeros(HISTORY_LEN)
+        self._deadline = None
+        self._tick_start = None
+        self._slot = 0
+
+    def start(self):
+        """Start the tick grid at the current time."""
+        self._deadline = self._clock()
+        self._tick_start = self._deadline
+        self.ticks = 0
+        self.late_ticks = 0
+        self.skipped_ticks = 0
+
+    def wait(self):
+        """End the current tick and wait until the next one is due.
+
+        Returns:
+            int: The number of ticks skipped because this one overran.
+        """
+        skipped, delay = self._end_tick()
+        if delay > 0:
+            self._sleep(delay)
+        self._begin_tick()
+        return skipped
+
+    async def wait_async(self):
+        """End the current tick and wait on the event loop until the next one.
+
+        Returns:
+            int: The number of ticks skipped because this one overran.
+        """
+        skipped, delay = self._end_tick()
+        await asyncio.sleep(max(delay, 0))
+        self._begin_tick()
+        return skipped
+
+    def _end_tick(self):
+        """Account for the tick that just ended and schedule the next one.
+
+        Returns:
+            tuple: The number of ticks skipped and the delay in seconds until
+                the next tick is due.
+        """
+        if self._deadline is None:
+            self.start()
+
+        now = self._clock()
+        work = now - self._tick_start
+        self._slot = self.ticks % HISTORY_LEN
+        self._work[self._slot] = work
+        self.ticks += 1
+        if work > self.period:
+            self.late_ticks += 1
+
+        # Deadlines stay on the grid no matter how long the work took
+        self._deadline += self.period
+        skipped = 0
+        if now > self._deadline:
+            missed = int((now - self._deadline) // self.period)
+            if self.policy == SKIP:
+                skipped = missed + 1
+            else:
+                skipped = max(missed - self.max_catch_up, 0)
+            self._deadline += skipped * self.period
+            self.skipped_ticks += skipped
+
+        return skipped, self._deadline - now
+
+    def _begin_tick(self):
+        """Mark the start of a tick and record how late it started."""
+        self._tick_start = self._clock()
+        self._jitter[self._slot] = self._tick_start - self._deadline
+
+    def stats(self):
+        """Get the jitter and overrun statistics of the recent ticks.
+
+        Jitter is how late each tick started relative to its deadline. Work is
+        the time spent between the start of a tick and the call to wait().
+
+        Returns:
+            dict: Tick counts, jitter and work time statistics in seconds,
+                and utilization as the mean work time over the period.
+        """
+        count = min(self.ticks, HISTORY_LEN)
+        if count == 0:
+            return {
+                "ticks": 0, "late_ticks": 0, "skipped_ticks": 0,
+                "jitter_mean": 0.0, "jitter_p99": 0.0, "jitter_max": 0.0,
+                "work_mean": 0.0, "work_p99": 0.0, "work_max": 0.0,
+                "utilization": 0.0
+            }
+
+        jitter = self._jitter[:count]
+        work = self._work[:count]
+        return {
+            "ticks": self.ticks,
+            "late_ticks": self.late_ticks,
+            "skipped_ticks": self.skipped_ticks,
+            "jitter_mean": float(jitter.mean()),
+            "jitter_p99": float(np.percentile(jitter, 99)),
+            "jitter_max": float(jitter.max()),
+            "work_mean": float(work.mean()),
+            "work_p99": float(np.percentile(work, 99)),
+            "work_max": float(work.max()),
+            "utilization": float(work.mean() / self.period)
+        }
@@ -0,0 +1,348 @@
+"""
+Module: session_archive.py
+
+This module exports a recorded session from the database to a session
+archive, and imports archives back into a database. An archive is a
+directory of .npy column files and a small JSON manifest:
+
+    manifest.json             The session, driver names, frame count, number
+                              of car slots and the file of every column.
+    frames.<field>.npy        tick and session_time, one value per frame, and
+                              the per-car fields, one row of car slots per
+                              frame.
+    events.<column>.npy       One value per event.
+    commentary.<column>.npy   One value per commentary.
+
+Every column is a plain NumPy array, so analysis scripts can open a whole
+endurance race with np.load(mmap_mode="r") in milliseconds, and only the
+pages they touch are read from disk. SessionArchive does this for all the
+columns and can be replayed by recorder.ReplaySource like a recording file.
+"""
+
+import json
+import os
+from itertools import zip_longest
+
+import numpy as np
+
+from core import telemetry
+from core.database_manager import TELEMETRY_COLUMNS
+
+# Archive identification
+FORMAT = "intellicaster-session-archive"
+VERSION = 1
+MANIFEST = "manifest.json"
+
+# Per-car frame fields, and the value of car slots without a row
+CAR_COLUMNS = {
+    "position": 0,
+    "lap": -1,
+    "lap_pct": -1.0,
+    "speed": np.nan,
+    "on_pit_road": False,
+    "track_surface": telemetry.NOT_IN_WORLD,
+}
+
+# Columns of the events and commentary tables; text columns are stored as
+# fixed-width unicode arrays
+EVENT_COLUMNS = ("id", "session_time", "event_type", "description", "driver", "timestamp")
+COMMENTARY_COLUMNS = ("id", "session_time", "timestamp", "text", "event_types", "drivers")
+_NUMERIC = {"id": np.int64, "session_time": np.float64}
+
+
+def _column_file(group, name):
+    """Get the file name of a column."""
+    return f"{group}.{name}.npy"
+
+
+def _save_table(directory, group, rows, columns, manifest):
+    """Save rows of a table as one .npy file per column.
+
+    Args:
+        directory (str): The archive directory.
+        group (str): The table's name in the archive.
+        rows (list): The rows, as dictionaries.
+        columns (tuple): The columns to save.
+        manifest (dict): The manifest to add the files to.
+    """
+    files = {}
+    for name in columns:
+        values = [row.get(name) for row in rows]
+        if name in _NUMERIC:
+            if _NUMERIC[name] is np.float64:
+                values = [np.nan if value is None else value for value in values]
+            array = np.array(values, dtype=_NUMERIC[name])
+        else:
+            array = np.array(["" if value is None else str(value) for value in values], dtype=str)
+        files[name] = _column_file(group, name)
+        np.save(os.path.join(directory, files[name]), array)
+    manifest["columns"][group] = files
+    manifest["counts"][group] = len(rows)
+
+
+def export_session(db, session_id, directory, chunk_size=100000):
+    """Export a session from the database to an archive directory.
+
+    Telemetry is streamed from the database straight into memory-mapped
+    .npy files, so a session of any length is exported in constant memory.
+    The manifest is written last; a directory without one is an unfinished
+    export.
+
+    Args:
+        db (DatabaseManager): The database to export from.
+        session_id (int): The session to export.
+        directory (str): The archive directory. It is created if needed,
+            and existing archive files in it are overwritten.
+        chunk_size (int): The number of telemetry rows read at a time.
+
+    Returns:
+        dict: The archive's manifest.
+    """
+    db.flush()
+    session = next((s for s in db.sessions() if s["id"] == session_id), None)
+    if session is None:
+        raise ValueError(f"There is no session {session_id} in the database.")
+
+    ticks, num_cars = db.telemetry_ticks(session_id)
+    names = [""] * num_cars
+    for car_idx, name in db.driver_names(session_id).items():
+        if car_idx < num_cars:
+            names[car_idx] = name
+
+    os.makedirs(directory, exist_ok=True)
+    manifest = {
+        "format": FORMAT,
+        "version": VERSION,
+        "session": session,
+        "num_cars": num_cars,
+        "frames": len(ticks),
+        "names": names,
+        "columns": {},
+        "counts": {},
+    }
+
+    # Allocate the frame columns as .npy files and fill them chunk by chunk
+    dtypes = dict(TELEMETRY_COLUMNS)
+    columns = {}
+    files = {}
+    for name, shape, fill in (("tick", (len(ticks),), 0),
+                              ("session_time", (len(ticks),), np.nan)):
+        files[name] = _column_file("frames", name)
+        columns[name] = np.lib.format.open_memmap(
+            os.path.join(directory, files[name]), mode="w+", dtype=dtypes[name], shape=shape
+        )
+        columns[name][:] = fill
+    for name, fill in CAR_COLUMNS.items():
+        files[name] = _column_file("frames", name)
+        columns[name] = np.lib.format.open_memmap(
+            os.path.join(directory, files[name]), mode="w+", dtype=dtypes[name],
+            shape=(len(ticks), num_cars)
+        )
+        columns[name][:] = fill
+    columns["tick"][:] = ticks
+
+    for chunk in db.iter_telemetry(session_id, chunk_size=chunk_size):
+        rows = np.searchsorted(ticks, chunk["tick"])
+        cars = chunk["car_idx"]
+        columns["session_time"][rows] = chunk["session_time"]
+        for name in CAR_COLUMNS:
+            columns[name][rows, cars] = chunk[name]
+    for array in columns.values():
+        array.flush()
+    del columns
+    manifest["columns"]["frames"] = files
+    manifest["counts"]["frames"] = len(ticks)
+
+    _save_table(directory, "events", list(db.iter_events(session_id)), EVENT_COLUMNS, manifest)
+    _save_table(directory, "commentary", list(db.iter_commentary(session_id)),
+                COMMENTARY_COLUMNS, manifest)
+
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def import_session(db, directory, source=None):
+    """Import an archive into the database as a new session.
+
+    The import begins, and ends, the database's current session, so it
+    should not be run while the director is recording to the same manager.
+
+    Args:
+        db (DatabaseManager): The database to import into.
+        directory (str): The archive directory.
+        source (str): The new session's source, or None to name the archive.
+
+    Returns:
+        int: The new session's id.
+    """
+    archive = SessionArchive(directory)
+    session_id = db.begin_session(source or f"archive:{os.path.abspath(directory)}")
+
+    snapshot = telemetry.FieldSnapshot(archive.num_cars)
+    for index in range(len(archive)):
+        archive.read_frame(index, snapshot)
+        db.insert_frame(snapshot, archive.names)
+
+    events = archive.events
+    for i in range(archive.counts.get("events", 0)):
+        session_time = float(events["session_time"][i])
+        db.insert_event(
+            str(events["event_type"][i]), str(events["description"][i]),
+            str(events["driver"][i]), str(events["timestamp"][i]),
+            session_time=None if np.isnan(session_time) else session_time
+        )
+
+    commentary = archive.commentary
+    for i in range(archive.counts.get("commentary", 0)):
+        session_time = float(commentary["session_time"][i])
+        types = str(commentary["event_types"][i]).split()
+        drivers = [d for d in str(commentary["drivers"][i]).split(", ") if d]
+        db.insert_commentary(
+            str(commentary["text"][i]),
+            [{"type": t, "driver": d} for t, d in zip_longest(types, drivers, fillvalue="")],
+            str(commentary["timestamp"][i]),
+            session_time=None if np.isnan(session_time) else session_time
+        )
+
+    db.end_session()
+    db.flush()
+    return session_id
+
+
+class SessionArchive:
+    """A memory-mapped, read-only view of a session archive.
+
+    Provides the same interface as recorder.TelemetryRecording, so it can be
+    replayed by recorder.ReplaySource.
+
+    Attributes:
+        frames (dict): The frame columns by field name: tick and
+            session_time of shape (frames,), and the per-car fields of shape
+            (frames, num_cars).
+        events (dict): The event columns by name.
+        commentary (dict): The commentary columns by name.
+        names (list): Driver names indexed by car idx.
+        num_cars (int): The number of car slots per frame.
+        session (dict): The session's row from the sessions table.
+    """
+
+    def __init__(self, directory, mmap_mode="r"):
+        """Open an archive.
+
+        Args:
+            directory (str): The archive directory.
+            mmap_mode (str): The np.load memory-map mode, or None to read
+                the columns into memory.
+        """
+        path = os.path.join(directory, MANIFEST)
+        if not os.path.isfile(path):
+            raise ValueError(f"{directory} is not a session archive.")
+        with open(path, encoding="utf-8") as file:
+            manifest = json.load(file)
+        if manifest.get("format") != FORMAT or manifest.get("version") != VERSION:
+            raise ValueError(f"{directory} is not a session archive.")
+
+        self.directory = directory
+        self.manifest = manifest
+        self.session = manifest["session"]
+        self.num_cars = manifest["num_cars"]
+        self.names = manifest["names"] or [""] * self.num_cars
+        self.counts = manifest["counts"]
+
+        def load(group):
+            columns = {}
+            for name, file_name in manifest["columns"].get(group, {}).items():
+                # Empty arrays cannot be memory-mapped
+                mode = mmap_mode if self.counts.get(group) else None
+                columns[name] = np.load(os.path.join(directory, file_name), mmap_mode=mode)
+            return columns
+
+        self.frames = load("frames")
+        self.events = load("events")
+        self.commentary = load("commentary")
+
+    def __len__(self):
+        return len(self.frames["tick"])
+
+    def frame_time(self, index):
+        """Get the session time of a frame.
+
+        Args:
+            index (int): The frame.
+
+        Returns:
+            float: The frame's session time.
+        """
+        return float(self.frames["session_time"][index])
+
+    def read_frame(self, index, snapshot):
+        """Copy a frame into a snapshot.
+
+        Args:
+            index (int): The frame to read.
+            snapshot (FieldSnapshot): The snapshot to overwrite.
+        """
+        snapshot.tick = int(self.frames["tick"][index])
+        snapshot.session_time = self.frame_time(index)
+        for attr in telemetry.CAR_FIELDS:
+            np.copyto(getattr(snapshot, attr), self.frames[attr][index])
+        snapshot.update_derived()
+
+
+# Benchmark of exporting a long session and opening it for analysis:
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    from core import database_manager
+
+    num_cars = 60
+    ticks = 60 * 60 * 30
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = database_manager.DatabaseManager(
+            os.path.join(directory, "race.db"), write_behind=True,
+            telemetry_storage=database_manager.COMPRESSED
+        )
+        session_id = db.begin_session("benchmark")
+        snapshot = telemetry.FieldSnapshot(num_cars)
+        snapshot.track_surface[:] = 3
+        snapshot.position[:] = np.arange(1, num_cars + 1)
+        speeds = np.linspace(0.010, 0.011, num_cars) / 60
+        for tick in range(ticks):
+            snapshot.tick = tick
+            snapshot.session_time = tick / 60
+            distance = speeds * tick
+            snapshot.lap[:] = distance.astype(np.int32)
+            snapshot.lap_pct[:] = distance % 1.0
+            db.insert_frame(snapshot, [f"Driver {i}" for i in range(num_cars)])
+            if tick % 600 == 0:
+                db.insert_event("overtake", f"Driver {tick % num_cars} overtakes", "", "",
+                                session_time=snapshot.session_time)
+        db.end_session()
+        db.flush()
+
+        path = os.path.join(directory, "race")
+        start = time.perf_counter()
+        export_session(db, session_id, path)
+        print(f"Exported {ticks} frames of {num_cars} cars in {time.perf_counter() - start:.2f} s")
+
+        start = time.perf_counter()
+        rows = sum(len(chunk["tick"]) for chunk in db.iter_telemetry(session_id))
+        print(f"  reading it back from the database: {time.perf_counter() - start:.2f} s")
+
+        start = time.perf_counter()
+        archive = SessionArchive(path)
+        opened = time.perf_counter() - start
+        start = time.perf_counter()
+        leader_lap = archive.frames["lap"][-1].max()
+        print(f"  opening the archive: {opened * 1000:.2f} ms; "
+              f"leader's last lap {leader_lap} read in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        start = time.perf_counter()
+        np.mean(archive.frames["lap_pct"])
+        print(f"  mean of all {archive.frames['lap_pct'].size} lap_pct values: "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms")
+        del archive
+        db.close()
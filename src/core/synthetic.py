@@ -0,0 +1,337 @@
+"""
+Module: synthetic.py
+
+This module provides a synthetic stand-in for the pyirsdk IRSDK object. It
+implements the parts of the IRSDK surface IntelliCaster uses (startup,
+connection status, CarIdx telemetry arrays, CameraInfo, DriverInfo and camera
+switching) on top of a simple vectorized race simulation, so the director and
+camera code can be load-tested headlessly without iRacing.
+
+The race is simulated with configurable field size and rates for overtakes,
+pit stops and on-track stalls. Rates are expressed per car: overtake_rate and
+stall_rate in events per minute, pit_rate as a probability per lap.
+"""
+
+import time
+
+import numpy as np
+
+from core import telemetry
+
+# Camera groups reported in CameraInfo
+CAMERA_GROUPS = [
+    "Nose", "Gearbox", "Roll Bar", "LF Susp", "LR Susp", "Gyro", "RF Susp",
+    "RR Susp", "Cockpit", "Scenic", "TV1", "TV2", "TV3", "Pit Lane", "Chase",
+    "Far Chase", "Blimp", "Chopper"
+]
+
+
+class SyntheticIRSDK:
+    """A fake IRSDK object driven by a simulated race.
+
+    In realtime mode the simulation advances with the wall clock at
+    tick_rate, like iRacing does. Otherwise it advances by exactly one tick
+    every time the var buffer is frozen, so a consumer can run unthrottled.
+
+    Attributes:
+        camera_switches (list): Every (position, group, camera) passed to
+            cam_switch_pos, for inspection after a run.
+    """
+
+    def __init__(self, num_cars=40, tick_rate=60, lap_time=90.0,
+                 overtake_rate=1.0, pit_rate=0.05, stall_rate=0.02,
+                 realtime=True, seed=None):
+        """Initialize the simulated race.
+
+        Args:
+            num_cars (int): The number of cars in the field (up to 64).
+            tick_rate (int): Simulation ticks per second.
+            lap_time (float): The average lap time in seconds.
+            overtake_rate (float): Pace bursts per car per minute. Bursts make
+                cars close up on and pass the car ahead.
+            pit_rate (float): Probability of a car pitting on each lap.
+            stall_rate (float): Stalls per car per minute.
+            realtime (bool): Whether to advance with the wall clock.
+            seed (int): Optional random seed for a reproducible race.
+        """
+        if not 0 < num_cars <= telemetry.MAX_CARS:
+            raise ValueError(f"num_cars must be between 1 and {telemetry.MAX_CARS}.")
+
+        self.num_cars = num_cars
+        self.tick_rate = tick_rate
+        self.lap_time = lap_time
+        self.overtake_rate = overtake_rate
+        self.pit_rate = pit_rate
+        self.stall_rate = stall_rate
+        self.realtime = realtime
+        self.camera_switches = []
+
+        self.is_initialized = False
+        self.session_info_update = 0
+        self._rng = np.random.default_rng(seed)
+        self._frozen = False
+        self._start_wall = None
+        self._reset()
+
+    def _reset(self):
+        """Put every car on the grid at the start of the race."""
+        n = self.num_cars
+        self.tick = 0
+        self.session_time = 0.0
+
+        # Each car's base pace in laps per second, within about 1.5% of each
+        # other, with the faster cars further up the grid
+        pace = np.sort(self._rng.normal(1.0, 0.005, n))[::-1]
+        self._pace = pace / self.lap_time
+        self._total_dist = 1.0 - 0.004 * np.arange(n)
+        self._boost_timer = np.zeros(n)
+        self._pit_timer = np.zeros(n)
+        self._stall_timer = np.zeros(n)
+        self._on_pit_road = np.zeros(n, dtype=bool)
+        self._track_surface = np.full(n, telemetry.ON_TRACK, dtype=np.int32)
+        self._position = np.arange(1, n + 1, dtype=np.int32)
+
+        self._drivers = [
+            {
+                "CarIdx": idx,
+                "UserName": f"Driver {chr(65 + idx % 26)}{idx // 26 or ''}",
+                "CarNumber": str(idx + 1),
+                "CarIsPaceCar": 0,
+                "IsSpectator": 0
+            }
+            for idx in range(n)
+        ]
+        self._cameras = {
+            "Groups": [
+                {
+                    "GroupNum": num + 1,
+                    "GroupName": name,
+                    "Cameras": [{"CameraNum": 1, "CameraName": "CamNose"}]
+                }
+                for num, name in enumerate(CAMERA_GROUPS)
+            ]
+        }
+
+    def startup(self, test_file=None, dump_to=None):
+        """Connect to the simulated race.
+
+        Args:
+            test_file: Ignored, accepted for compatibility with IRSDK.
+            dump_to: Ignored, accepted for compatibility with IRSDK.
+
+        Returns:
+            bool: Always True.
+        """
+        if not self.is_initialized:
+            self.is_initialized = True
+            self.session_info_update += 1
+            self._start_wall = time.monotonic()
+        return True
+
+    def shutdown(self):
+        """Disconnect from the simulated race."""
+        self.is_initialized = False
+        self._frozen = False
+
+    @property
+    def is_connected(self):
+        """Whether the simulated race is running."""
+        return self.is_initialized
+
+    def freeze_var_buffer_latest(self):
+        """Advance the simulation and hold its state until unfrozen.
+
+        Outside realtime mode this is the only call that advances the
+        simulation, by exactly one tick.
+        """
+        if self.realtime:
+            self._sync()
+        elif self.is_initialized:
+            self.step()
+        self._frozen = True
+
+    def unfreeze_var_buffer_latest(self):
+        """Release the state held by freeze_var_buffer_latest."""
+        self._frozen = False
+
+    def cam_switch_pos(self, position=0, group=1, camera=0):
+        """Record a camera switch.
+
+        Args:
+            position (int): The race position to focus on.
+            group (int): The camera group number.
+            camera (int): The camera number.
+        """
+        self.camera_switches.append((position, group, camera))
+
+    def __getitem__(self, key):
+        """Get a telemetry variable or session info section.
+
+        Args:
+            key (str): The variable or section name.
+
+        Returns:
+            The value in the same shape pyirsdk returns it, or None if the
+            key is not simulated.
+        """
+        if not self._frozen:
+            self._sync()
+
+        if key == "CameraInfo":
+            return self._cameras
+        if key == "DriverInfo":
+            return {"DriverCarIdx": 0, "Drivers": self._drivers}
+        if key == "SessionTick":
+            return self.tick
+        if key == "SessionTime":
+            return self.session_time
+
+        values = self._car_values(key)
+        if values is None:
+            return None
+
+        # pyirsdk returns lists padded to 64 cars
+        fill = {"CarIdxPosition": 0, "CarIdxOnPitRoad": False}.get(key, -1)
+        padded = np.full(telemetry.MAX_CARS, fill, dtype=values.dtype)
+        padded[:self.num_cars] = values
+        return padded.tolist()
+
+    def _car_values(self, key):
+        """Get the simulated values of a CarIdx variable.
+
+        Args:
+            key (str): The CarIdx variable name.
+
+        Returns:
+            numpy.ndarray: One value per simulated car, or None.
+        """
+        if key == "CarIdxPosition":
+            return self._position
+        if key == "CarIdxLap":
+            return np.floor(self._total_dist).astype(np.int32)
+        if key == "CarIdxLapDistPct":
+            return (self._total_dist % 1.0).astype(np.float32)
+        if key == "CarIdxOnPitRoad":
+            return self._on_pit_road
+        if key == "CarIdxTrackSurface":
+            return self._track_surface
+        return None
+
+    def _sync(self):
+        """Advance a realtime simulation to the current time."""
+        if not self.is_initialized or not self.realtime:
+            return
+
+        target = int((time.monotonic() - self._start_wall) * self.tick_rate)
+
+        # Don't try to catch up more than a second at once
+        steps = min(target - self.tick, self.tick_rate)
+        for _ in range(steps):
+            self.step()
+
+        # Skip ahead if we fell further behind than that
+        if target > self.tick:
+            self.tick = target
+            self.session_time = target / self.tick_rate
+
+    def step(self):
+        """Advance the simulated race by one tick."""
+        dt = 1.0 / self.tick_rate
+        rng = self._rng
+        n = self.num_cars
+        self.tick += 1
+        self.session_time += dt
+
+        # Count down the timers for bursts, pit stops and stalls
+        for timer in (self._boost_timer, self._pit_timer, self._stall_timer):
+            np.subtract(timer, dt, out=timer)
+            np.maximum(timer, 0.0, out=timer)
+
+        pitting = self._pit_timer > 0
+        stalled = self._stall_timer > 0
+        racing = ~pitting & ~stalled
+
+        # Start new pace bursts and stalls among the racing cars
+        bursts = racing & (rng.random(n) < self.overtake_rate / 60 * dt)
+        self._boost_timer[bursts] = rng.uniform(3.0, 8.0, bursts.sum())
+        stalls = racing & (rng.random(n) < self.stall_rate / 60 * dt)
+        self._stall_timer[stalls] = rng.uniform(5.0, 20.0, stalls.sum())
+        stalled |= stalls
+        racing &= ~stalls
+
+        # Move the racing cars, with some per-tick noise
+        speed = self._pace * rng.normal(1.0, 0.01, n)
+        speed[self._boost_timer > 0] *= 1.04
+        speed[~racing] = 0.0
+        prev_lap = np.floor(self._total_dist)
+        self._total_dist += speed * dt
+
+        # Cars crossing the line may decide to pit on the new lap
+        crossed = racing & (np.floor(self._total_dist) > prev_lap)
+        pits = crossed & (rng.random(n) < self.pit_rate)
+        self._pit_timer[pits] = rng.uniform(20.0, 30.0, pits.sum())
+        pitting |= pits
+
+        self._on_pit_road[:] = pitting
+        self._track_surface[:] = telemetry.ON_TRACK
+        self._track_surface[pitting] = telemetry.IN_PIT_STALL
+        self._track_surface[stalled] = telemetry.OFF_TRACK
+
+        # Rank the field by distance covered
+        order = np.argsort(-self._total_dist, kind="stable")
+        self._position[order] = np.arange(1, n + 1, dtype=np.int32)
+
+
+# Headless load test of the director against a synthetic race:
+if __name__ == "__main__":
+    import argparse
+    import configparser
+    import os
+    import tempfile
+    import threading
+
+    from core import common, director
+
+    parser = argparse.ArgumentParser(
+        description="Load-test the director against a synthetic race."
+    )
+    parser.add_argument("--cars", type=int, default=60)
+    parser.add_argument("--rate", type=int, default=60)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    class HeadlessApp:
+        """Collect the messages the app window would normally show."""
+
+        def __init__(self):
+            self.messages = []
+
+        def add_message(self, message):
+            self.messages.append(message)
+
+    common.app = HeadlessApp()
+    common.settings = configparser.ConfigParser()
+    common.context = {"league": {"name": "Synthetic League", "short_name": "SYN"}}
+    common.ir = SyntheticIRSDK(num_cars=args.cars, tick_rate=args.rate)
+    print(f"iRacing running: {common.check_iracing()}")
+
+    # Run until the timer stops the director, keeping its settings.ini and
+    # intellicaster.db out of the working directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            race_director = director.Director()
+            threading.Timer(args.seconds, race_director.stop).start()
+            race_director.run()
+        finally:
+            os.chdir(cwd)
+
+    print(f"Simulated {common.ir.tick} ticks, "
+          f"{len(common.ir.camera_switches)} camera switches, "
+          f"{len(common.app.messages)} app messages")
+    print(f"Tick stats: {race_director.tick_stats()}")
+    print(f"Pipeline stats: {race_director.pipeline_stats()}")
+    print(f"Detector stats: {race_director.detector_stats()}")
+    print(f"Coalescer stats: {race_director.coalescer.stats()}")
+    print(f"Admission stats: {race_director.admission_stats()}")
@@ -0,0 +1,390 @@
+"""
+Module: telemetry.py
+
+This module adapts the iRacing SDK (common.ir) into a struct-of-arrays field
+snapshot. Instead of building one dictionary per driver every tick, the per-car
+CarIdx arrays are read once per tick into preallocated NumPy arrays indexed by
+car idx, which the rest of the director can work on directly.
+"""
+
+import collections
+
+import numpy as np
+
+from core import common
+
+# iRacing always reports CarIdx arrays with room for 64 cars
+MAX_CARS = 64
+
+# Values reported in CarIdxTrackSurface (irsdk_TrkLoc)
+NOT_IN_WORLD = -1
+OFF_TRACK = 0
+IN_PIT_STALL = 1
+APPROACHING_PITS = 2
+ON_TRACK = 3
+
+# Mapping of snapshot array names to the iRacing variables they are read from
+CAR_FIELDS = {
+    "position": "CarIdxPosition",
+    "lap": "CarIdxLap",
+    "lap_pct": "CarIdxLapDistPct",
+    "on_pit_road": "CarIdxOnPitRoad",
+    "track_surface": "CarIdxTrackSurface",
+}
+
+
+class FieldSnapshot:
+    """The state of every car in the field at a single telemetry tick.
+
+    Each per-car value is stored in its own NumPy array indexed by car idx, so
+    detectors can compare whole fields at once instead of looping over dicts.
+    The arrays are allocated once and overwritten in place on every read.
+
+    Attributes:
+        tick (int): The SessionTick the snapshot was taken at.
+        session_time (float): The SessionTime the snapshot was taken at.
+        position (numpy.ndarray): Race position per car (0 if unclassified).
+        lap (numpy.ndarray): Current lap per car.
+        lap_pct (numpy.ndarray): Fraction of the current lap completed.
+        on_pit_road (numpy.ndarray): Whether each car is on pit road.
+        track_surface (numpy.ndarray): CarIdxTrackSurface value per car.
+        total_dist (numpy.ndarray): Laps completed plus lap_pct.
+        valid (numpy.ndarray): Whether each car idx holds a car in the world.
+    """
+
+    __slots__ = (
+        "num_cars", "tick", "session_time", "position", "lap", "lap_pct",
+        "on_pit_road", "track_surface", "total_dist", "valid"
+    )
+
+    def __init__(self, num_cars=MAX_CARS):
+        """Allocate the per-car arrays.
+
+        Args:
+            num_cars (int): The number of car slots to allocate.
+        """
+        self.num_cars = num_cars
+        self.tick = 0
+        self.session_time = 0.0
+        self.position = np.zeros(num_cars, dtype=np.int32)
+        self.lap = np.full(num_cars, -1, dtype=np.int32)
+        self.lap_pct = np.full(num_cars, -1.0, dtype=np.float32)
+        self.on_pit_road = np.zeros(num_cars, dtype=bool)
+        self.track_surface = np.full(num_cars, NOT_IN_WORLD, dtype=np.int32)
+        self.total_dist = np.zeros(num_cars, dtype=np.float64)
+        self.valid = np.zeros(num_cars, dtype=bool)
+
+    def update_derived(self):
+        """Recompute the derived arrays after the raw arrays were written."""
+        np.greater_equal(self.track_surface, OFF_TRACK, out=self.valid)
+        np.logical_and(self.valid, self.lap_pct >= 0.0, out=self.valid)
+        np.add(self.lap, self.lap_pct, out=self.total_dist)
+
+    def copy_from(self, other):
+        """Copy another snapshot's contents into this one without allocating.
+
+        Args:
+            other (FieldSnapshot): The snapshot to copy from.
+        """
+        self.tick = other.tick
+        self.session_time = other.session_time
+        np.copyto(self.position, other.position)
+        np.copyto(self.lap, other.lap)
+        np.copyto(self.lap_pct, other.lap_pct)
+        np.copyto(self.on_pit_road, other.on_pit_road)
+        np.copyto(self.track_surface, other.track_surface)
+        np.copyto(self.total_dist, other.total_dist)
+        np.copyto(self.valid, other.valid)
+
+    def car_indices(self):
+        """Get the car idxs that currently hold a car in the world.
+
+        Returns:
+            numpy.ndarray: The valid car idxs.
+        """
+        return np.flatnonzero(self.valid)
+
+    def to_dict(self, names=None):
+        """Convert the snapshot into a JSON serializable dictionary.
+
+        Only valid cars are included. This is intended for logging, not for
+        the per-tick hot path.
+
+        Args:
+            names (list): Optional driver names indexed by car idx.
+
+        Returns:
+            dict: The tick, session time and a list of per-car dictionaries.
+        """
+        cars = []
+        for idx in self.car_indices():
+            cars.append({
+                "car_idx": int(idx),
+                "name": names[idx] if names else "",
+                "position": int(self.position[idx]),
+                "lap": int(self.lap[idx]),
+                "lap_percent": float(self.lap_pct[idx]),
+                "on_pit_road": bool(self.on_pit_road[idx]),
+                "track_surface": int(self.track_surface[idx]),
+            })
+        return {
+            "tick": self.tick,
+            "session_time": self.session_time,
+            "cars": cars
+        }
+
+
+class SnapshotBuffer:
+    """Two preallocated snapshot slots holding the current and previous tick.
+
+    The current tick is written into the current slot in place. Once it has
+    been processed, swap() turns it into the previous slot and hands the old
+    previous slot back to be overwritten by the next tick. Nothing is copied
+    or allocated per tick.
+    """
+
+    __slots__ = ("_slots", "_current", "_filled")
+
+    def __init__(self, num_cars=MAX_CARS):
+        """Allocate both slots.
+
+        Args:
+            num_cars (int): The number of car slots per snapshot.
+        """
+        self._slots = (FieldSnapshot(num_cars), FieldSnapshot(num_cars))
+        self._current = 0
+        self._filled = 0
+
+    @property
+    def current(self):
+        """FieldSnapshot: The slot holding (or receiving) the current tick."""
+        return self._slots[self._current]
+
+    @property
+    def previous(self):
+        """FieldSnapshot: The slot holding the previous tick, or None if
+        fewer than two ticks have been processed."""
+        if self._filled < 1:
+            return None
+        return self._slots[self._current ^ 1]
+
+    def swap(self):
+        """Make the current tick the previous one and free the other slot."""
+        self._current ^= 1
+        self._filled = min(self._filled + 1, 2)
+
+    def reset(self):
+        """Forget both ticks, e.g. when a new session starts."""
+        self._filled = 0
+
+
+class SnapshotPool:
+    """A fixed set of preallocated snapshots handed between threads.
+
+    A producer acquires a snapshot, fills it and passes it downstream; the
+    last consumer releases it back to the pool once it is done with it, so in
+    steady state nothing is allocated per tick. If every snapshot is in use
+    (or some were dropped by a queue and never released), acquire() allocates
+    a new one, and release() lets the garbage collector have any snapshot
+    beyond the pool's size.
+
+    Attributes:
+        allocated (int): Snapshots allocated because the pool was empty.
+    """
+
+    def __init__(self, size, num_cars=MAX_CARS):
+        """Allocate the pool's snapshots.
+
+        Args:
+            size (int): The number of snapshots kept in the pool.
+            num_cars (int): The number of car slots per snapshot.
+        """
+        self.num_cars = num_cars
+        self.size = size
+        self.allocated = 0
+        self._free = collections.deque(FieldSnapshot(num_cars) for _ in range(size))
+
+    def acquire(self):
+        """Take a snapshot from the pool.
+
+        Returns:
+            FieldSnapshot: A snapshot holding stale data, to be overwritten.
+        """
+        try:
+            return self._free.pop()
+        except IndexError:
+            self.allocated += 1
+            return FieldSnapshot(self.num_cars)
+
+    def release(self, snapshot):
+        """Return a snapshot to the pool.
+
+        Args:
+            snapshot (FieldSnapshot): A snapshot from acquire() that nothing
+                references any more.
+        """
+        if len(self._free) < self.size:
+            self._free.append(snapshot)
+
+    def stats(self):
+        """Get the pool's metrics.
+
+        Returns:
+            dict: Free snapshots, pool size and snapshots allocated on demand.
+        """
+        return {"free": len(self._free), "size": self.size, "allocated": self.allocated}
+
+
+class TelemetrySource:
+    """Base class for anything the director can read field snapshots from.
+
+    Attributes:
+        names (list): Driver names indexed by car idx.
+        paced (bool): True if read() itself waits until the next frame is
+            due, so the caller should not sleep between reads.
+        finished (bool): True once the source has no more frames to give.
+    """
+
+    paced = False
+    finished = False
+
+    def __init__(self, num_cars=MAX_CARS):
+        """Initialize the source.
+
+        Args:
+            num_cars (int): The number of car slots in each snapshot.
+        """
+        self.num_cars = num_cars
+        self.names = [""] * num_cars
+
+    def new_snapshot(self):
+        """Allocate a snapshot sized for this source.
+
+        Returns:
+            FieldSnapshot: An empty snapshot.
+        """
+        return FieldSnapshot(self.num_cars)
+
+    def read(self, snapshot):
+        """Read the next frame into a snapshot.
+
+        Args:
+            snapshot (FieldSnapshot): The snapshot to overwrite.
+
+        Returns:
+            bool: True if the snapshot was updated, False otherwise.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the source."""
+        pass
+
+
+class TelemetryAdapter(TelemetrySource):
+    """Read the per-car CarIdx arrays from the iRacing SDK once per tick.
+
+    The adapter freezes the latest variable buffer so that every array in a
+    snapshot comes from the same telemetry tick, then writes the values into
+    a preallocated FieldSnapshot.
+    """
+
+    def __init__(self, ir=None, num_cars=MAX_CARS, reader=None):
+        """Initialize the adapter.
+
+        Args:
+            ir: The IRSDK object to read from. If None, common.ir is used at
+                read time, so the adapter can be created before connecting.
+            num_cars (int): The number of car slots in each snapshot.
+            reader (SharedMemoryReader): Optional zero-copy reader. If given,
+                the CarIdx arrays are read through it instead of through
+                the IRSDK object, which is then only used for DriverInfo.
+        """
+        super().__init__(num_cars)
+        self._ir = ir
+        self.reader = reader
+        self._session_info_update = None
+
+    @property
+    def ir(self):
+        """The IRSDK object currently being read from."""
+        return self._ir if self._ir is not None else common.ir
+
+    def read(self, snapshot):
+        """Read the latest telemetry tick into a snapshot.
+
+        Args:
+            snapshot (FieldSnapshot): The snapshot to overwrite.
+
+        Returns:
+            bool: True if the snapshot was updated, False if iRacing is not
+                connected.
+        """
+        ir = self.ir
+        if self.reader is not None:
+            return self._read_zero_copy(ir, snapshot)
+        if not ir or not ir.is_connected:
+            return False
+
+        # Make sure every variable below comes from the same tick
+        ir.freeze_var_buffer_latest()
+        try:
+            snapshot.tick = ir["SessionTick"] or 0
+            snapshot.session_time = ir["SessionTime"] or 0.0
+            for attr, var_name in CAR_FIELDS.items():
+                values = ir[var_name]
+                if values is None:
+                    continue
+                getattr(snapshot, attr)[:] = values[:self.num_cars]
+        finally:
+            ir.unfreeze_var_buffer_latest()
+
+        snapshot.update_derived()
+        self._refresh_names(ir)
+        return True
+
+    def close(self):
+        """Close the zero-copy reader, if any."""
+        if self.reader is not None:
+            self.reader.shutdown()
+
+    def _read_zero_copy(self, ir, snapshot):
+        """Read the latest tick through the zero-copy reader.
+
+        Args:
+            ir: The IRSDK object to read DriverInfo from, if any.
+            snapshot (FieldSnapshot): The snapshot to overwrite.
+
+        Returns:
+            bool: True if the snapshot was updated, False otherwise.
+        """
+        # The memory map only exists once iRacing is running
+        if not self.reader.is_initialized and not self.reader.startup():
+            return False
+        if not self.reader.read_into(snapshot):
+            return False
+
+        if ir and ir.is_connected:
+            self._refresh_names(ir)
+        return True
+
+    def _refresh_names(self, ir):
+        """Update the cached driver names when the session info changes.
+
+        Args:
+            ir: The IRSDK object to read DriverInfo from.
+        """
+        update = getattr(ir, "session_info_update", None)
+        if update is not None and update == self._session_info_update:
+            return
+        self._session_info_update = update
+
+        driver_info = ir["DriverInfo"]
+        if not driver_info:
+            return
+        for driver in driver_info.get("Drivers", []):
+            idx = driver.get("CarIdx", -1)
+            if 0 <= idx < self.num_cars:
+                self.names[idx] = common.remove_numbers(
+                    driver.get("UserName", "")
+                )
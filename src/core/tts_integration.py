@@ -0,0 +1,103 @@
+"""
+Module: tts_integration.py
+
+This module converts commentary text into speech using the ElevenLabs
+text-to-speech API. Requests are made with an async HTTP client, so many
+clips can be in flight on one event loop at once. Generated clips are saved
+to the iRacing videos folder as commentary_<milliseconds>.mp3, timed from the
+start of the recording, which is the format the editor expects.
+"""
+
+import os
+import time
+
+import httpx
+
+from core import common
+
+# ElevenLabs REST API
+API_URL = "https://api.elevenlabs.io/v1"
+DEFAULT_MODEL = "eleven_monolingual_v1"
+
+
+class TTSIntegration:
+    def __init__(self):
+        # Retrieve the API key and voice from settings
+        self.api_key = common.settings.get("keys", "elevenlabs_api_key", fallback="")
+        self.voice = common.settings.get("commentary", "pbp_voice", fallback="Harry")
+        self.model = common.settings.get("commentary", "tts_model", fallback=DEFAULT_MODEL)
+        self._voice_ids = {}
+
+    async def _get_voice_id(self, client, name):
+        """Look up the ElevenLabs voice ID for a voice name.
+
+        :param client: The httpx.AsyncClient to make the request with.
+        :param name: The voice name (e.g., 'Harry').
+        :return: The voice ID, or the name itself if it isn't found.
+        """
+        if not self._voice_ids:
+            response = await client.get(
+                f"{API_URL}/voices", headers={"xi-api-key": self.api_key}
+            )
+            response.raise_for_status()
+            for voice in response.json().get("voices", []):
+                self._voice_ids[voice["name"]] = voice["voice_id"]
+        return self._voice_ids.get(name, name)
+
+    async def synthesize(self, client, text, voice=None):
+        """
+        Convert text to speech.
+
+        :param client: The httpx.AsyncClient to make the request with.
+        :param text: The text to speak.
+        :param voice: Optional voice name; defaults to the play-by-play voice.
+        :return: The MP3 audio as bytes.
+        """
+        voice_id = await self._get_voice_id(client, voice or self.voice)
+        response = await client.post(
+            f"{API_URL}/text-to-speech/{voice_id}",
+            headers={"xi-api-key": self.api_key, "accept": "audio/mpeg"},
+            json={"text": text, "model_id": self.model}
+        )
+        response.raise_for_status()
+        return response.content
+
+    def save_clip(self, audio, timestamp=None):
+        """
+        Save an audio clip to the iRacing videos folder for the editor.
+
+        :param audio: The MP3 audio as bytes.
+        :param timestamp: Wall clock time the clip should start at; defaults
+            to now.
+        :return: The path of the saved clip.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        start = common.recording_start_time or timestamp
+        file_name = f"commentary_{int((timestamp - start) * 1000)}.mp3"
+
+        videos = os.path.join(
+            common.settings.get("general", "iracing_path", fallback="."), "videos"
+        )
+        os.makedirs(videos, exist_ok=True)
+        path = os.path.join(videos, file_name)
+        with open(path, "wb") as file:
+            file.write(audio)
+
+        # Register the clip so the editor cleans it up after export
+        with open(os.path.join(videos, "intellicaster.tmp"), "a") as file:
+            file.write(f"{file_name}\n")
+        return path
+
+    async def speak(self, client, text, voice=None, timestamp=None):
+        """
+        Convert text to speech and save it as a commentary clip.
+
+        :param client: The httpx.AsyncClient to make the request with.
+        :param text: The text to speak.
+        :param voice: Optional voice name; defaults to the play-by-play voice.
+        :param timestamp: Wall clock time the clip should start at.
+        :return: The path of the saved clip.
+        """
+        audio = await self.synthesize(client, text, voice)
+        return self.save_clip(audio, timestamp)